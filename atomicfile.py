@@ -0,0 +1,42 @@
+"""
+ファイルを一時ファイル経由で置き換える
+
+書き込みの途中で止まったり、他のプロセスが同時に読んだりしても
+古い内容か新しい内容のどちらかが見えるようにする
+"""
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+
+
+@contextmanager
+def replacing(path, mode="wb", encoding=None):
+    """
+    with の中で書いたファイルで path を置き換える
+    例外で抜けたときは path をそのまま残す
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 並列実行時に他のプロセスと一時ファイルが衝突しないように
+    tmp = path.with_suffix(".{}.tmp".format(os.getpid()))
+    try:
+        with open(tmp, mode, encoding=encoding) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        raise
+
+
+def write_bytes(path, data: bytes):
+    with replacing(path) as f:
+        f.write(data)
+
+
+def write_json(path, obj, **kwargs):
+    with replacing(path, "w", encoding="UTF-8") as f:
+        json.dump(obj, f, **kwargs)
@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+"""
+fgoupdate の読み込み処理の速度を計測する
+
+fgoupdate.ini と fgodata のローカルリポジトリが必要
+"""
+import argparse
+import json
+import logging
+import time
+import tracemalloc
+
+import fgoupdate
+import htmlextract
+import jsonstream
+
+logger = logging.getLogger(__name__)
+
+
+def measure(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_blob(args):
+    """
+    git show を毎回起動する従来の方法と常駐 cat-file の比較
+    キャッシュは使わずに読み込み+デコードの時間だけを計る
+    """
+    files = fgoupdate.table_files()
+    revs = [args.cid, args.cid + "^"]
+
+    def git_show():
+        for rev in revs:
+            for filename in files:
+                json.loads(fgoupdate.repo.git.show(rev + ":" + filename))
+
+    def cat_file():
+        for rev in revs:
+            for filename in files:
+                sha = fgoupdate.blob_sha(filename, rev)
+                json.loads(fgoupdate.read_blob(sha))
+
+    # 常駐プロセスの起動分は除外する
+    fgoupdate.blob_sha(files[0], args.cid)
+    fgoupdate.read_blob(fgoupdate.blob_sha(files[0], args.cid))
+    t_show = measure(git_show, args.repeat)
+    t_cat = measure(cat_file, args.repeat)
+    print("{} tables x {} commits".format(len(files), len(revs)))
+    print("git show       : {:8.3f} s".format(t_show))
+    print("cat-file batch : {:8.3f} s".format(t_cat))
+    print("speedup        : {:8.2f} x".format(t_show / t_cat))
+
+
+def measure_peak(func):
+    """
+    func 実行中のメモリ使用量のピーク(bytes)
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_stream(args):
+    """
+    json.load でテーブル全体を読む方法と必要な列だけを1行ずつ読む方法の比較
+    """
+    path = fgoupdate.fgodata_local_repo / args.table
+    fields = args.fields.split(",")
+    predicate = None
+    if args.min_id is not None:
+        predicate = lambda row: row["id"] >= args.min_id  # noqa: E731
+
+    def full():
+        with open(path, 'rb') as fp:
+            rows = json.load(fp)
+        return jsonstream.project_rows(rows, fields, predicate)
+
+    def stream():
+        with open(path, 'rb') as fp:
+            return list(jsonstream.iter_rows(fp, fields, predicate))
+
+    if full() != stream():
+        raise RuntimeError("result mismatch")
+    t_full = measure(full, args.repeat)
+    t_stream = measure(stream, args.repeat)
+    m_full = measure_peak(full)
+    m_stream = measure_peak(stream)
+    print("{} ({})  backend: {}".format(
+        args.table, ",".join(fields),
+        "ijson" if jsonstream.ijson is not None else "json.raw_decode"))
+    print("json.load : {:8.3f} s {:10.1f} MiB".format(t_full, m_full / 2**20))
+    print("stream    : {:8.3f} s {:10.1f} MiB".format(t_stream,
+                                                     m_stream / 2**20))
+
+
+def bench_html(args):
+    """
+    保存した news.fate-go.jp のページからの取り出しを
+    BeautifulSoup (html.parser) と lxml で比較する
+    """
+    if not htmlextract.HAS_LXML:
+        raise RuntimeError("lxml is not installed")
+    extract = {"list": htmlextract.news_list,
+               "accordion": htmlextract.accordion,
+               "article": htmlextract.article}[args.kind]
+    for path in args.files:
+        with open(path, 'rb') as f:
+            content = f.read()
+        if extract(content, "bs4") != extract(content, "lxml"):
+            raise RuntimeError("result mismatch: " + path)
+        t_bs4 = measure(lambda: extract(content, "bs4"), args.repeat)
+        t_lxml = measure(lambda: extract(content, "lxml"), args.repeat)
+        print("{} ({}, {} KiB)".format(path, args.kind, len(content) // 1024))
+        print("bs4     : {:8.4f} s".format(t_bs4))
+        print("lxml    : {:8.4f} s".format(t_lxml))
+        print("speedup : {:8.2f} x".format(t_bs4 / t_lxml))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                description='Benchmark fgoupdate loaders'
+                )
+    parser.add_argument('-c', '--cid',
+                        default='HEAD', help='COMMIT IDを指定')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='繰り返し回数(最速値を表示)')
+    subparsers = parser.add_subparsers(dest='target', required=True)
+    subparsers.add_parser('blob', help='git show と cat-file --batch の比較')
+    parser_stream = subparsers.add_parser(
+        'stream', help='json.load と1行ずつの読み込みの比較')
+    parser_stream.add_argument('-t', '--table', default=fgoupdate.mstQuest_file,
+                               help='テーブルのファイル名')
+    parser_stream.add_argument('-f', '--fields', default='id,name',
+                               help='取り出す列(カンマ区切り)')
+    parser_stream.add_argument('--min-id', type=int,
+                               help='id がこれ以上の行だけを取り出す')
+    parser_html = subparsers.add_parser(
+        'html', help='BeautifulSoup と lxml でのページの取り出しの比較')
+    parser_html.add_argument('-k', '--kind', default='accordion',
+                             choices=('list', 'accordion', 'article'),
+                             help='ページの種類(list: 不具合一覧、'
+                                  'accordion: 現在確認している不具合、'
+                                  'article: 個別の記事)')
+    parser_html.add_argument('files', nargs='+', help='保存したページ')
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(name)s <%(filename)s-L%(lineno)s>'
+               + ' [%(levelname)s] %(message)s',
+    )
+    if args.target == 'blob':
+        bench_blob(args)
+    elif args.target == 'stream':
+        bench_stream(args)
+    elif args.target == 'html':
+        bench_html(args)
@@ -0,0 +1,442 @@
+"""
+Discord webhook への投稿キュー
+
+チェックの処理は投稿を待たずに進め、投稿は1本のスレッドが順番どおりに送る
+webhook ごとのレート制限(X-RateLimit-* ヘッダー)を守り、
+429 のときは retry_after だけ待って送り直す
+通信エラーと 5xx は間隔を伸ばしながら再送する
+
+同じ webhook への続けての投稿は、Discord の制限の範囲で
+1つのメッセージ(embed 10個・添付ファイル10個まで)にまとめて送る
+まとめている途中の投稿は seal() か flush() で送信待ちになる
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+
+import httpclient
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 5
+# 429 が続いたときに諦めるまでの回数
+MAX_RATE_LIMITED = 10
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# Discord の1メッセージあたりの制限
+MAX_EMBEDS = 10
+MAX_EMBED_CHARS = 6000
+MAX_FILES = 10
+MAX_FILE_BYTES = 10 * 1024 * 1024
+MAX_FIELDS = 25
+# embed の項目ごとの文字数の制限
+TEXT_LIMITS = {"title": 256, "description": 4096}
+FIELD_NAME_LIMIT = 256
+FIELD_VALUE_LIMIT = 1024
+
+
+def text_file(filename, text):
+    """
+    文字列をそのまま添付ファイル (ファイル名, UTF-8 のバイト列) にする
+    """
+    return (filename, text.encode("UTF-8"))
+
+
+def read_files(file):
+    """
+    投稿するファイルを {名前: (ファイル名, 中身)} にする
+    (ファイル名, 中身) はメモリ上の中身なのでそのまま使う
+    ファイルオブジェクトは、キューに入れている間に元のファイルが消されてもよいように
+    中身を読んで閉じておく
+    """
+    files = {}
+    for name, f in file.items():
+        if isinstance(f, tuple):
+            files[name] = f
+            continue
+        files[name] = (os.path.basename(f.name), f.read())
+        f.close()
+    return files
+
+
+def make_payload(content=None, username=None, avatar_url=None, tts=False,
+                 embeds=None, allowed_mentions=None):
+    """
+    discordwebhook と同じ形式の投稿内容
+    """
+    data = {}
+    if content is not None:
+        data["content"] = content
+    if username is not None:
+        data["username"] = username
+    if avatar_url is not None:
+        data["avatar_url"] = avatar_url
+    data["tts"] = tts
+    if embeds is not None:
+        data["embeds"] = embeds
+    if allowed_mentions is not None:
+        data["allowed_mentions"] = allowed_mentions
+    return data
+
+
+def clip(text, limit):
+    if len(text) <= limit:
+        return text
+    return text[:limit - 1] + "…"
+
+
+def split_embed(embed):
+    """
+    文字数の制限を超える項目を切り詰め、
+    field が多すぎる embed は複数の embed に分ける
+    元の embed は書き換えない
+    """
+    embed = dict(embed)
+    for key, limit in TEXT_LIMITS.items():
+        if isinstance(embed.get(key), str):
+            embed[key] = clip(embed[key], limit)
+    fields = [dict(f, name=clip(str(f["name"]), FIELD_NAME_LIMIT),
+                   value=clip(str(f["value"]), FIELD_VALUE_LIMIT))
+              for f in embed.get("fields", [])]
+    if len(fields) <= MAX_FIELDS:
+        if "fields" in embed:
+            embed["fields"] = fields
+        return [embed]
+    embeds = []
+    for i in range(0, len(fields), MAX_FIELDS):
+        if i == 0:
+            e = dict(embed, fields=fields[:MAX_FIELDS])
+        else:
+            e = {"fields": fields[i:i + MAX_FIELDS]}
+            if "color" in embed:
+                e["color"] = embed["color"]
+        embeds.append(e)
+    return embeds
+
+
+def embed_length(embed):
+    """
+    Discord が数える embed の文字数
+    """
+    n = len(embed.get("title", "")) + len(embed.get("description", ""))
+    n += len(embed.get("footer", {}).get("text", ""))
+    n += len(embed.get("author", {}).get("name", ""))
+    for f in embed.get("fields", []):
+        n += len(f["name"]) + len(f["value"])
+    return n
+
+
+class Message:
+    """
+    まとめて送る1つのメッセージ
+    """
+    def __init__(self, url, payload, files):
+        self.url = url
+        self.payload = payload
+        self.files = {}
+        self.file_bytes = 0
+        self.embed_chars = sum(embed_length(e)
+                               for e in payload.get("embeds", []))
+        # 送り終えたら True、諦めたら False
+        self.delivered = None
+        self._add_files(files)
+
+    def _add_files(self, files):
+        for name, (filename, data) in (files or {}).items():
+            # 別の投稿と名前が重ならないように付け直す
+            self.files["file{}".format(len(self.files) + 1)] = \
+                (filename, data)
+            self.file_bytes += len(data)
+
+    def merge(self, payload, files):
+        """
+        payload をこのメッセージに追加できれば追加して True を返す
+        """
+        head = {k: v for k, v in self.payload.items() if k != "embeds"}
+        other = {k: v for k, v in payload.items() if k != "embeds"}
+        if "content" in head or head != other:
+            return False
+        embeds = payload.get("embeds", [])
+        chars = sum(embed_length(e) for e in embeds)
+        file_bytes = sum(len(d) for n, d in (files or {}).values())
+        if len(self.payload.get("embeds", [])) + len(embeds) > MAX_EMBEDS \
+           or self.embed_chars + chars > MAX_EMBED_CHARS \
+           or len(self.files) + len(files or {}) > MAX_FILES \
+           or self.file_bytes + file_bytes > MAX_FILE_BYTES:
+            return False
+        if len(embeds) > 0:
+            self.payload["embeds"] = self.payload.get("embeds", []) + embeds
+        self.embed_chars += chars
+        self._add_files(files)
+        return True
+
+
+class Bucket:
+    """
+    webhook ごとのレート制限の状態
+    """
+    def __init__(self):
+        self.remaining = None
+        self.reset_at = 0.0
+
+    def update(self, headers):
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        try:
+            if remaining is not None:
+                self.remaining = int(remaining)
+            if reset_after is not None:
+                self.reset_at = time.monotonic() + float(reset_after)
+        except ValueError:
+            logger.debug("bad rate limit headers: %s", headers)
+
+    def block(self, seconds):
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, time.monotonic() + seconds)
+
+    def delay(self):
+        """
+        次に送れるまでの秒数
+        """
+        if self.remaining != 0:
+            return 0.0
+        return max(0.0, self.reset_at - time.monotonic())
+
+
+def retry_after(response):
+    """
+    429 の応答から待つ秒数を取り出す
+    """
+    try:
+        return float(response.json()["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        pass
+    try:
+        return float(response.headers.get("Retry-After", 1))
+    except ValueError:
+        return 1.0
+
+
+class DeliveryQueue:
+    """
+    投稿を FIFO で送るキュー
+    同じ webhook への投稿は put した順番で送る
+    """
+    def __init__(self, session=None):
+        self.session = session if session is not None else httpclient
+        self.sent = 0
+        self.failed = 0
+        # webhook -> 送信待ちにしたメッセージ数
+        self.messages = {}
+        self._queue = queue.Queue()
+        # webhook -> まとめている途中のメッセージ
+        self._pending = {}
+        self._buckets = {}
+        self._global_reset = 0.0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, url, payload, files=None):
+        """
+        投稿を追加して、それを含むメッセージを返す
+        まとめている途中のメッセージに入らなければ、それを送信待ちにする
+        """
+        with self._lock:
+            message = self._pending.get(url)
+            if message is not None and message.merge(payload, files):
+                return message
+            if message is not None:
+                self._send_later(message)
+            message = Message(url, payload, files)
+            self._pending[url] = message
+            return message
+
+    def seal(self):
+        """
+        まとめている途中のメッセージを全て送信待ちにする
+        """
+        with self._lock:
+            for message in self._pending.values():
+                self._send_later(message)
+            self._pending = {}
+
+    def flush(self):
+        """
+        全て送り終わるまで待つ
+        """
+        self.seal()
+        if self._thread is None:
+            return
+        self._queue.join()
+
+    def stop(self):
+        """
+        全て送り終えてから送信スレッドを止める
+        fork する前に呼ぶ (スレッドがロックを持ったまま fork させない)
+        次に送信待ちにしたときにスレッドは作り直す
+        """
+        self.flush()
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(None)
+        thread.join()
+        self._thread = None
+
+    def _send_later(self, message):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run,
+                                            name="delivery", daemon=True)
+            self._thread.start()
+        self.messages[message.url] = self.messages.get(message.url, 0) + 1
+        self._queue.put(message)
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                self._queue.task_done()
+                break
+            files = message.files if len(message.files) > 0 else None
+            try:
+                message.delivered = self._deliver(message.url,
+                                                  message.payload, files)
+            except Exception as e:
+                logger.exception(e)
+                message.delivered = False
+                self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    def _wait(self, bucket):
+        delay = max(bucket.delay(), self._global_reset - time.monotonic())
+        if delay > 0:
+            logger.debug("rate limited: wait %.2f s", delay)
+            time.sleep(delay)
+
+    def _send(self, url, payload, files):
+        if files is not None:
+            return self.session.post(
+                url, {"payload_json": json.dumps(payload)}, files=files)
+        return self.session.post(
+            url, json.dumps(payload),
+            headers={"Content-Type": "application/json"})
+
+    def _deliver(self, url, payload, files):
+        bucket = self._buckets.setdefault(url, Bucket())
+        errors = 0
+        rate_limited = 0
+        while True:
+            self._wait(bucket)
+            try:
+                r = self._send(url, payload, files)
+            except httpclient.CircuitOpenError as e:
+                # 送っていないので再送の回数には数えず、接続の再開を待つ
+                # (数えると待ち時間の合計が止めている時間より短く、諦めてしまう)
+                logger.warning("%s: wait %.2f s", e, e.retry_after)
+                time.sleep(e.retry_after)
+                continue
+            except requests.RequestException as e:
+                logger.warning("post failed: %s", e)
+                r = None
+            if r is not None:
+                bucket.update(r.headers)
+                if r.status_code == 429:
+                    rate_limited += 1
+                    seconds = retry_after(r)
+                    logger.warning("429 Too Many Requests: retry after %.2f s",
+                                   seconds)
+                    if rate_limited > MAX_RATE_LIMITED:
+                        break
+                    if r.headers.get("X-RateLimit-Global"):
+                        self._global_reset = time.monotonic() + seconds
+                    else:
+                        bucket.block(seconds)
+                    continue
+                if r.ok:
+                    self.sent += 1
+                    return True
+                if r.status_code < 500:
+                    # 内容の誤りなどは送り直しても通らない
+                    logger.error("post rejected: %s %s",
+                                 r.status_code, r.text[:200])
+                    self.failed += 1
+                    return False
+                logger.warning("post failed: %s", r.status_code)
+            errors += 1
+            if errors > MAX_RETRIES:
+                break
+            time.sleep(min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (errors - 1)))
+        logger.error("give up posting: %s", payload.get("embeds", payload))
+        self.failed += 1
+        return False
+
+
+default_queue = DeliveryQueue()
+# 終了前に残りを送り切る
+atexit.register(default_queue.flush)
+
+
+def seal():
+    default_queue.seal()
+
+
+def flush():
+    default_queue.flush()
+
+
+def stop():
+    default_queue.stop()
+
+
+class Webhook:
+    """
+    discordwebhook.Discord と同じ使い方で、投稿をキューに入れる
+    """
+    def __init__(self, *, url, delivery_queue=None):
+        self.url = url
+        self.queue = delivery_queue if delivery_queue is not None \
+            else default_queue
+
+    def post(self, *, content=None, username=None, avatar_url=None,
+             tts=False, file=None, embeds=None, allowed_mentions=None):
+        """
+        投稿をキューに入れて、それを含むメッセージのリストを返す
+        flush() の後に各メッセージの delivered で送れたかどうかが分かる
+        """
+        if content is None and file is None and embeds is None:
+            raise ValueError("required one of content, file, embeds")
+        if embeds is not None:
+            embeds = [e for embed in embeds for e in split_embed(embed)]
+        files = read_files(file) if file is not None else None
+        if content is not None or embeds is None:
+            payload = make_payload(content=content, username=username,
+                                   avatar_url=avatar_url, tts=tts,
+                                   embeds=embeds,
+                                   allowed_mentions=allowed_mentions)
+            return [self.queue.put(self.url, payload, files)]
+        # embed 1つずつ追加すれば制限の範囲でまとめ直される
+        messages = []
+        for i, embed in enumerate(embeds):
+            payload = make_payload(username=username, avatar_url=avatar_url,
+                                   tts=tts, embeds=[embed],
+                                   allowed_mentions=allowed_mentions)
+            message = self.queue.put(self.url, payload,
+                                     files if i == len(embeds) - 1 else None)
+            if message not in messages:
+                messages.append(message)
+        return messages
+
+    @property
+    def messages(self):
+        """
+        この webhook に送信待ちにしたメッセージ数
+        """
+        return self.queue.messages.get(self.url, 0)
@@ -0,0 +1,325 @@
+"""
+マスター装備の必要経験値のグラフ
+
+比べるための既存の装備の4本の折れ線は毎回同じなので1回だけ描いておき、
+新しい装備の点と凡例だけを重ねる
+
+- matplotlib: 折れ線を描いた Figure をプロセスの中で使い回す
+  pyplot は読み込まない(常駐時は2回目以降の読み込みと描画が無くなる)
+- pillow: matplotlib を読み込まずに Pillow で同じ体裁のグラフを描く
+  折れ線まで描いた画像を状態ディレクトリに保存しておき、次の実行からはそれに重ねる
+  点が既存の装備の範囲に収まらないときは軸を広げて全部描き直す(保存はしない)
+"""
+from hashlib import blake2b
+from importlib.util import find_spec
+import logging
+from math import ceil, floor, log10
+import os
+from pathlib import Path
+import threading
+
+import atomicfile
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("matplotlib", "pillow")
+# 描画ライブラリは使うときに読み込む
+BACKEND = "matplotlib" if find_spec("matplotlib") is not None else "pillow"
+
+TITLE = 'マスター装備必要経験値'
+XLABEL = 'Lv'
+LEVELS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+# 比べるための既存の装備 (凡例, 必要経験値)
+BASELINES = [
+    ('魔術礼装･カルデア',
+     [0, 10000, 40000, 100000, 220000,
+      460000, 940000, 1900000, 3820000, 7660000]),
+    ('恒常装備',
+     [0, 1569000, 4707000, 9414000, 15690000,
+      23535000, 32949000, 43932000, 56484000, 70605000]),
+    ('期間限定装備',
+     [0, 53000, 132500, 305000, 609000,
+      1218000, 2200000, 3727000, 5963000, 8950000]),
+    ('魔術礼装･極地用カルデア制服',
+     [0, 3451800, 10355400, 20710800, 34518000,
+      51777000, 72487800, 96650400, 124264800, 155331000]),
+]
+
+# 日本語を表示できるフォントを探す場所(設定で指定が無いとき)
+FONT_CANDIDATES = [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/fonts-japanese-gothic.ttf",
+    "/usr/share/fonts/opentype/ipaexfont-gothic/ipaexg.ttf",
+    "C:/Windows/Fonts/meiryo.ttc",
+    "C:/Windows/Fonts/msgothic.ttc",
+    "/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+]
+
+# matplotlib の既定 (6.4x4.8 インチ, 100 dpi, tab10) に合わせる
+WIDTH, HEIGHT = 640, 480
+DPI = 100
+# 縦横2倍で描いて縮小する(アンチエイリアスの代わり)
+SCALE = 2
+AXES = (0.125, 0.11, 0.9, 0.88)  # left, bottom, right, top
+COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd"]
+MARGIN = 0.05
+# 保存した画像の作り方を変えたら上げる
+PILLOW_VERSION = 1
+
+_lock = threading.Lock()
+_figure = None
+_fonts = {}
+
+
+def find_font(font=None):
+    """
+    使うフォントのパス 見つからなければ None
+    """
+    if font:
+        return font
+    for path in FONT_CANDIDATES:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def render(name, mc_exp, fp, backend=None, font=None, cache_dir=None):
+    """
+    name の装備の必要経験値 mc_exp を既存の装備と並べて PNG で fp に保存する
+    fp はファイル名かバイナリのファイルオブジェクト
+    cache_dir は pillow で折れ線まで描いた画像を保存するディレクトリ
+    """
+    with _lock:
+        if (backend or BACKEND) == "pillow":
+            _render_pillow(name, mc_exp, fp, find_font(font), cache_dir)
+        else:
+            _render_matplotlib(name, mc_exp, fp, font)
+
+
+def _baseline_figure(font):
+    global _figure
+    if _figure is None:
+        from matplotlib.figure import Figure
+        fig = Figure()
+        ax = fig.add_subplot(1, 1, 1)
+        for label, exps in BASELINES:
+            ax.plot(LEVELS, exps)
+        # 新しい装備の点 (データは描くときに入れる)
+        points, = ax.plot([], [], " ", marker='o')
+        prop = None
+        if font:
+            from matplotlib.font_manager import FontProperties
+            prop = FontProperties(fname=font)
+        ax.set_title(TITLE, fontproperties=prop)
+        ax.set_xlabel(XLABEL)  # x軸ラベル
+        _figure = (fig, ax, points, prop)
+    return _figure
+
+
+def _render_matplotlib(name, mc_exp, fp, font):
+    fig, ax, points, prop = _baseline_figure(font)
+    points.set_data(LEVELS, mc_exp)
+    ax.relim()
+    ax.autoscale_view()
+    ax.legend([label for label, exps in BASELINES] + [name], prop=prop)
+    fig.savefig(fp, format="png")
+
+
+def _px(pt):
+    return pt * DPI / 72 * SCALE
+
+
+def _font(path, pt):
+    from PIL import ImageFont
+    key = (path, pt)
+    if key not in _fonts:
+        size = round(_px(pt))
+        if path is None:
+            try:
+                _fonts[key] = ImageFont.load_default(size=size)
+            except TypeError:
+                # Pillow 10.1 より前は大きさを指定できない
+                _fonts[key] = ImageFont.load_default()
+        else:
+            _fonts[key] = ImageFont.truetype(path, size)
+    return _fonts[key]
+
+
+def ticks(lo, hi, nbins):
+    """
+    lo から hi の間の切りのよい目盛り (matplotlib の MaxNLocator に近い)
+    """
+    raw = (hi - lo) / nbins
+    magnitude = 10 ** floor(log10(raw))
+    for s in (1, 2, 2.5, 5, 10):
+        step = s * magnitude
+        if step >= raw:
+            break
+    values = []
+    v = ceil(lo / step) * step
+    while v <= hi + step * 1e-9:
+        values.append(v)
+        v += step
+    return values
+
+
+def tick_labels(values):
+    """
+    目盛りの文字列と、大きな値のときの軸の上に出す指数 (1e8 など)
+    """
+    top = max(abs(v) for v in values)
+    exponent = floor(log10(top)) if top >= 1e6 else 0
+    scaled = [v / 10 ** exponent for v in values]
+    for digits in range(4):
+        if all(abs(round(v, digits) - v) < 1e-9 for v in scaled):
+            break
+    labels = ["{:.{}f}".format(v, digits) for v in scaled]
+    offset = "1e{}".format(exponent) if exponent != 0 else ""
+    return labels, offset
+
+
+class _Axes:
+    """
+    データの座標から画素の座標への変換
+    """
+    def __init__(self, ymax):
+        w, h = WIDTH * SCALE, HEIGHT * SCALE
+        self.left = AXES[0] * w
+        self.right = AXES[2] * w
+        self.top = (1 - AXES[3]) * h
+        self.bottom = (1 - AXES[1]) * h
+        xspan = LEVELS[-1] - LEVELS[0]
+        self.xlim = (LEVELS[0] - xspan * MARGIN, LEVELS[-1] + xspan * MARGIN)
+        self.ylim = (-ymax * MARGIN, ymax * (1 + MARGIN))
+
+    def x(self, v):
+        lo, hi = self.xlim
+        return self.left + (v - lo) / (hi - lo) * (self.right - self.left)
+
+    def y(self, v):
+        lo, hi = self.ylim
+        return self.bottom - (v - lo) / (hi - lo) * (self.bottom - self.top)
+
+
+def _draw_baseline(ymax, font):
+    """
+    軸・目盛り・既存の装備の折れ線・タイトルまで描いた画像
+    """
+    from PIL import Image, ImageDraw
+    im = Image.new("RGB", (WIDTH * SCALE, HEIGHT * SCALE), "white")
+    draw = ImageDraw.Draw(im)
+    ax = _Axes(ymax)
+    label_font = _font(font, 10)
+    tick_len, pad, width = _px(3.5), _px(3.5), max(1, round(_px(0.8)))
+
+    for i, (label, exps) in enumerate(BASELINES):
+        draw.line([(ax.x(lv), ax.y(e)) for lv, e in zip(LEVELS, exps)],
+                  fill=COLORS[i], width=round(_px(1.5)), joint="curve")
+    draw.rectangle([ax.left, ax.top, ax.right, ax.bottom],
+                   outline="black", width=width)
+
+    for v in ticks(*ax.xlim, 5):
+        x = ax.x(v)
+        draw.line([(x, ax.bottom), (x, ax.bottom + tick_len)],
+                  fill="black", width=width)
+        draw.text((x, ax.bottom + tick_len + pad), "{:g}".format(v),
+                  fill="black", font=label_font, anchor="ma")
+    yticks = ticks(*ax.ylim, 9)
+    labels, offset = tick_labels(yticks)
+    for v, label in zip(yticks, labels):
+        y = ax.y(v)
+        draw.line([(ax.left - tick_len, y), (ax.left, y)],
+                  fill="black", width=width)
+        draw.text((ax.left - tick_len - pad, y), label,
+                  fill="black", font=label_font, anchor="rm")
+    if offset:
+        draw.text((ax.left, ax.top - pad), offset,
+                  fill="black", font=label_font, anchor="ld")
+
+    draw.text(((ax.left + ax.right) / 2, ax.top - _px(6)), TITLE,
+              fill="black", font=_font(font, 12), anchor="md")
+    xlabel_y = ax.bottom + tick_len + pad * 2 + _px(10)
+    draw.text(((ax.left + ax.right) / 2, xlabel_y), XLABEL,
+              fill="black", font=label_font, anchor="ma")
+    return im
+
+
+def _draw_overlay(im, name, mc_exp, ymax, font):
+    """
+    新しい装備の点と凡例を重ねる
+    """
+    from PIL import ImageDraw
+    draw = ImageDraw.Draw(im)
+    ax = _Axes(ymax)
+    r = _px(3)
+    for lv, e in zip(LEVELS, mc_exp):
+        x, y = ax.x(lv), ax.y(e)
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=COLORS[4])
+
+    # 凡例 (左上)
+    legend_font = _font(font, 10)
+    fs = _px(10)
+    labels = [label for label, exps in BASELINES] + [name]
+    row = fs * 1.5
+    handle = fs * 2
+    text_width = max(draw.textlength(label, font=legend_font)
+                     for label in labels)
+    x0 = ax.left + fs * 0.5
+    y0 = ax.top + fs * 0.5
+    x1 = x0 + fs * 0.4 * 2 + handle + fs * 0.8 + text_width
+    y1 = y0 + fs * 0.4 * 2 + row * len(labels) - fs * 0.5
+    draw.rounded_rectangle([x0, y0, x1, y1], radius=fs * 0.2,
+                           fill="white", outline="#cccccc",
+                           width=max(1, round(_px(1))))
+    for i, label in enumerate(labels):
+        cy = y0 + fs * 0.4 + row * i + fs / 2
+        hx0 = x0 + fs * 0.4
+        hx1 = hx0 + handle
+        if i < len(BASELINES):
+            draw.line([(hx0, cy), (hx1, cy)], fill=COLORS[i],
+                      width=round(_px(1.5)))
+        else:
+            cx = (hx0 + hx1) / 2
+            draw.ellipse([cx - r, cy - r, cx + r, cy + r], fill=COLORS[4])
+        draw.text((hx1 + fs * 0.8, cy), label, fill="black",
+                  font=legend_font, anchor="lm")
+
+
+def _baseline_path(cache_dir, font):
+    key = repr((PILLOW_VERSION, WIDTH, HEIGHT, SCALE, BASELINES, font))
+    digest = blake2b(key.encode("UTF-8"), digest_size=8).hexdigest()
+    return Path(cache_dir) / "equipchart_{}.png".format(digest)
+
+
+def _cached_baseline(ymax, font, cache_dir):
+    from PIL import Image
+    if cache_dir is None:
+        return _draw_baseline(ymax, font)
+    path = _baseline_path(cache_dir, font)
+    try:
+        with Image.open(path) as im:
+            return im.convert("RGB")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("broken chart cache %s: %s", path, e)
+    im = _draw_baseline(ymax, font)
+    with atomicfile.replacing(path) as f:
+        im.save(f, format="PNG")
+    return im
+
+
+def _render_pillow(name, mc_exp, fp, font, cache_dir):
+    from PIL import Image
+    ymax = max(max(exps) for label, exps in BASELINES)
+    if max(mc_exp) <= ymax:
+        im = _cached_baseline(ymax, font, cache_dir)
+    else:
+        # 既存の装備の範囲に収まらないので軸から描き直す
+        ymax = max(ymax, max(mc_exp))
+        im = _draw_baseline(ymax, font)
+    _draw_overlay(im, name, mc_exp, ymax, font)
+    im = im.resize((WIDTH, HEIGHT), Image.LANCZOS)
+    im.save(fp, format="PNG")
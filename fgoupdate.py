@@ -3,48 +3,75 @@ import sys
 import json
 from datetime import datetime
 import argparse
+import io
 import logging
 from pathlib import Path
-import configparser
-import tempfile
-import os
+import subprocess
 import re
+import multiprocessing
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-import git
-from discordwebhook import Discord
 from zc import lockfile
 from zc.lockfile import LockError
 
-import trouble
-import info_trouble
+import atomicfile
+import runtime
+from tablecache import TableCache
+import jsonstream
+import nameindex
+import equipchart
 
 logger = logging.getLogger(__name__)
 
-inifile = "fgoupdate.ini"
-basedir = Path(__file__).resolve().parent
-
-# 設定ファイル読み込み
-config = configparser.ConfigParser()
-configfile = basedir / Path(inifile)
-if configfile.exists() is False:
-    print("ファイル {} を作成してください".format(inifile), file=sys.stderr)
-    sys.exit(1)
-config.read(configfile)
-section1 = 'discord'
-webhook_url = config.get(section1, 'webhook')
-discord = Discord(url=webhook_url)
-webhook_error_url = config.get(section1, 'webhook4error', fallback=webhook_url)
-discord_error = Discord(url=webhook_error_url)
-
-section2 = 'fgodata'
-repo = config.get(section2, 'repository')
-fgodata = repo.replace("https://github.com/", "").replace(".git", "")
-fgodata_dir = fgodata.split("/")[-1]
-fgodata_local_repo = basedir.parent / fgodata_dir
-repo = git.Repo(fgodata_local_repo)
-origin = repo.remotes.origin
+basedir = runtime.basedir
+
+# 設定ファイル読み込み (trouble・info_trouble と共有)
+config = runtime.config()
+discord = runtime.discord
+discord_error = runtime.discord_error
+# requests を読み込むモジュールは使うときに読み込む (更新が無い回は読み込まない)
+trouble = runtime.lazy_import("trouble")
+info_trouble = runtime.lazy_import("info_trouble")
+delivery = runtime.lazy_import("delivery")
+tablediff = runtime.lazy_import("tablediff")
+
+# GitPython は使うときに読み込む (更新が無い回は読み込まない)
+fgodata_url = runtime.fgodata_url()
+fgodata_local_repo = runtime.fgodata_local_repo()
+repo = runtime.repo
+origin = runtime.origin
+
+section3 = 'cache'
+cache_dir = basedir / config.get(section3, 'directory', fallback="cache")
+cache_size_limit = config.getint(section3, 'size_limit_mb', fallback=512)
+table_cache = TableCache(cache_dir, size_limit=cache_size_limit * 1024 * 1024)
+
+# 前回までの処理結果を保存する
+state_dir = runtime.state_dir()
+snapshot_store = runtime.Lazy(
+    lambda: tablediff.SnapshotStore(state_dir / "snapshots"))
+
+section4 = 'update'
+# 取りこぼしを処理するコミット数の上限(古いものから切り捨てる)
+max_catchup = config.getint(section4, 'max_catchup', fallback=30)
+
+section6 = 'daemon'
+# 常駐時にリモートを確認する間隔(秒)
+daemon_interval = config.getint(section6, 'interval', fallback=60)
+# 常駐時に不具合情報をチェックする間隔(秒)
+news_interval = config.getint(section6, 'news_interval', fallback=300)
+
+section7 = 'chart'
+# マスター装備のグラフの描画 (matplotlib か pillow)
+chart_backend = config.get(section7, 'backend', fallback=equipchart.BACKEND)
+chart_font = config.get(section7, 'font', fallback=None)
 
 sha_json = "github_sha.json"
+# cron と --daemon で共有するロック (作業ディレクトリによらずスクリプトと同じ場所)
+lock_f = basedir / "lock"
 data_json = "fgoupdate.json"
 mstver_file = "mstver.json"
 mstQuest_file = "JP_tables/quest/mstQuest.json"
@@ -84,11 +111,8 @@ aa_url = "https://assets.atlasacademy.io"
 mstSvt = []
 mstClass = []
 id2class = {}
-mstSkill = []
-mstSkillDetail = []
-mstSkillLv = []
-mstFunc = []
-id2itemName = {}
+# コミットごとのテーブルのインデックス
+master = None
 id2card = {1: "A", 2: "B", 3: "Q"}
 id2card_long = {1: "Arts", 2: "Buster", 3: "Quick"}
 
@@ -102,6 +126,14 @@ class_dic = {
 cost2rarity = {16: "★5", 12: "★4", 7: "★3", 4: "★2",
                3: "★1", 0: "★4", 9: "9?", 1: "1?", 5: "5?"}
 postCount = 0
+# コミットをまたいで共有するパース済みテーブル blob SHA -> [世代, テーブル]
+# コミット N の「現在」はコミット N+1 の「親」なので再パースしなくてよい
+table_memo = {}
+memo_generation = 0
+# 処理中のコミットの差分 (blob SHA, 親の blob SHA, キー) -> TableDiff
+diff_memo = {}
+# 常駐 git cat-file はスレッド間で共有するので1度に1つの要求だけ送る
+git_lock = threading.Lock()
 
 
 def list2class(enemy):
@@ -114,41 +146,399 @@ def list2class(enemy):
     return out
 
 
+def pending_commits(sha_prev, sha):
+    """
+    sha_prev の次から sha までのコミットを古い順に返す
+    sha_prev が無い・履歴に無い(force push など)ときは sha だけを返す
+    max_catchup より多ければ古いほうから max_catchup 件だけ返す
+    (残りは次の回に処理する)
+    """
+    import git
+    if sha_prev == "":
+        return [sha]
+    try:
+        if not repo.is_ancestor(sha_prev, sha):
+            logger.warning("sha_prev %s is not an ancestor", sha_prev)
+            return [sha]
+    except git.GitCommandError:
+        logger.warning("sha_prev %s not found", sha_prev)
+        return [sha]
+    commits = [c.hexsha for c in repo.iter_commits(sha_prev + ".." + sha,
+                                                   first_parent=True)]
+    if len(commits) > max_catchup:
+        logger.warning("%d commits behind, process the oldest %d this time",
+                       len(commits), max_catchup)
+        commits = commits[-max_catchup:]
+    return commits[::-1]
+
+
+def table_files():
+    """
+    読み込むテーブルの一覧 (sparse-checkout の対象)
+    """
+    return sorted(set(v for k, v in globals().items()
+                      if k.endswith("_file") and isinstance(v, str)))
+
+
+def sparse_patterns():
+    return ["/" + f for f in table_files()]
+
+
+def setup_repo():
+    """
+    fgodata のローカルリポジトリを blob を持たない部分クローン
+    (--filter=blob:none) にして、読み込むテーブルだけを sparse-checkout する
+    既にあるリポジトリは設定だけを変える(取得済みの blob はそのまま残る)
+    親コミットの blob は cat-file で読むときに git が自動で取得する
+    """
+    import git
+    if not runtime.has_repo():
+        logger.info("clone %s (blob:none)", fgodata_url)
+        git.Repo.clone_from(fgodata_url, fgodata_local_repo,
+                            filter="blob:none", no_checkout=True)
+    else:
+        repo.git.config("remote.origin.promisor", "true")
+        repo.git.config("remote.origin.partialclonefilter", "blob:none")
+    repo.git.sparse_checkout("set", "--no-cone", *sparse_patterns())
+    # --no-checkout でクローンしたときは作業ツリーが空なので展開する
+    repo.git.read_tree("-mu", "HEAD")
+    logger.info("sparse-checkout %d files", len(table_files()))
+
+
+def update_sparse_checkout():
+    """
+    sparse-checkout しているリポジトリで、読み込むテーブルが増えていれば追加する
+    """
+    with repo.config_reader() as cr:
+        if not cr.get_value("core", "sparseCheckout", False):
+            return
+    current = repo.git.sparse_checkout("list").splitlines()
+    if current != sparse_patterns():
+        logger.info("update sparse-checkout")
+        repo.git.sparse_checkout("set", "--no-cone", *sparse_patterns())
+
+
+def load_sha():
+    """
+    前回チェックしたコミットの SHA 無ければ ""
+    """
+    filename = basedir / Path(sha_json)
+    if filename.exists():
+        with open(filename, 'r') as f1:
+            return json.load(f1)["sha"]
+    return ""
+
+
+def save_sha(cid):
+    """
+    cid まで処理したことを記録する
+    (途中で失敗したら次の回は処理し終えたコミットの次から始める)
+    """
+    sha = str(repo.rev_parse(cid)) if cid == "HEAD" else cid
+    atomicfile.write_json(basedir / Path(sha_json), {"sha": sha})
+
+
 def check_update():
+    """
+    前回チェックしたコミットから HEAD までの未処理コミットを古い順に返す
+    HEAD は作業ツリーから直に読めるように "HEAD" で返す
+    ここでは記録しない 処理し終えたコミットごとに save_sha で記録する
+    """
+    sha_prev = load_sha()
+    logger.debug("sha_prev: %s", sha_prev)
+    # リモートが進んでいなければ pull しない (GitPython も読み込まない)
+    if sha_prev != "":
+        try:
+            if remote_sha() == sha_prev:
+                return []
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.warning("ls-remote failed: %s", e)
+    update_sparse_checkout()
     origin.pull()
     sha = str(repo.rev_parse('HEAD'))
     logger.debug("sha: %s", sha)
-    filename = basedir / Path(sha_json)
-    if filename.exists():
-        f1 = open(filename, 'r')
-        sha_prev = json.load(f1)["sha"]
-    else:
-        sha_prev = ""
-    logger.debug("sha_prev: %s", sha_prev)
-    if sha != sha_prev:
-        f2 = open(filename, 'w')
-        json.dump({"sha": sha}, f2)
-        return True
-    return False
+    if sha == sha_prev:
+        return []
+    cids = pending_commits(sha_prev, sha)
+    if cids[-1] == sha:
+        cids[-1] = "HEAD"
+    return cids
+
+
+def git_command(*args):
+    """
+    GitPython を使わずに fgodata のリポジトリで git を実行して標準出力を返す
+    """
+    return subprocess.run(["git", "-C", str(fgodata_local_repo)] + list(args),
+                          check=True, capture_output=True,
+                          text=True).stdout.strip()
+
+
+def remote_sha():
+    """
+    pull せずに git ls-remote でリモートの追跡ブランチの SHA を調べる
+    """
+    try:
+        upstream = git_command("rev-parse", "--abbrev-ref",
+                               "--symbolic-full-name", "@{u}")
+        ref = "refs/heads/" + upstream.split("/", 1)[1]
+    except subprocess.CalledProcessError:
+        # detached HEAD など
+        ref = "HEAD"
+    out = git_command("ls-remote", "origin", ref)
+    if out == "":
+        return None
+    return out.split()[0]
+
+
+def blob_sha(filename, cid):
+    """
+    cid 時点の filename の blob SHA を返す
+    常駐している git cat-file --batch-check を使うのでプロセスは起動しない
+    """
+    with git_lock:
+        hexsha = repo.git.get_object_header(cid + ":" + filename)[0]
+    if isinstance(hexsha, bytes):
+        hexsha = hexsha.decode()
+    return hexsha
+
+
+def read_blob(sha):
+    """
+    blob の中身を bytes で返す
+    常駐している git cat-file --batch を使うので
+    テーブルごとに git show を起動しなくてよい
+    """
+    with git_lock:
+        return repo.git.get_object_data(sha)[3]
+
+
+def load_projection(filename, cid, fields, predicate=None):
+    """
+    テーブル全体を dict にせずに fields の列のタプルのリストを返す
+    predicate があれば predicate(行) が真の行だけを返す
+    パース済みのテーブルがメモリにあればそれを使う
+    """
+    sha = blob_sha(filename, cid)
+    memo = table_memo.get(sha)
+    if memo is not None:
+        memo[0] = memo_generation
+        return jsonstream.project_rows(memo[1], fields, predicate)
+    if cid == "HEAD":
+        with open(fgodata_local_repo / filename, 'rb') as fp:
+            return list(jsonstream.iter_rows(fp, fields, predicate))
+    # cat-file --batch の出力をそのまま読む
+    # 読み残すと次の cat-file の応答がずれるので最後まで読み切る
+    with git_lock:
+        stream = repo.git.stream_object_data(sha)[3]
+        try:
+            return list(jsonstream.iter_rows(stream, fields, predicate))
+        finally:
+            while stream.read(jsonstream.CHUNK_SIZE):
+                pass
+
+
+def next_generation():
+    """
+    コミットの処理を切り替える
+    直前のコミットでも使わなかったテーブルはメモリから解放する
+    """
+    global memo_generation
+    global diff_memo
+    memo_generation += 1
+    diff_memo = {}
+    for sha in [k for k, v in table_memo.items()
+                if v[0] < memo_generation - 1]:
+        del table_memo[sha]
 
 
 def load_file(filename, cid):
     """
+    同じ blob をパース済みならそれを使う
+    blob SHA をキーにしたキャッシュがあればそれを使う
     高速化のため、HEADを読み込むときはgitを使用しないで直に読み込む
     """
+    sha = blob_sha(filename, cid)
+    memo = table_memo.get(sha)
+    if memo is not None:
+        memo[0] = memo_generation
+        return memo[1]
+    json_load = table_cache.get(sha)
+    if json_load is not None:
+        table_memo[sha] = [memo_generation, json_load]
+        return json_load
     if cid == "HEAD":
-        json_open = open(fgodata_local_repo / filename, 'r', encoding="UTF-8")
-        json_load = json.load(json_open)
+        with open(fgodata_local_repo / filename, 'rb') as json_open:
+            json_load = json.loads(json_open.read())
     else:
-        json_load = json.loads(repo.git.show(cid + ":" + filename))
+        json_load = json.loads(read_blob(sha))
+    table_cache.put(sha, json_load)
+    table_memo[sha] = [memo_generation, json_load]
     return json_load
 
 
+def diff_table(filename, cid, key="id", row_filter=None):
+    """
+    cid とその親コミットのテーブルの差分(tablediff.TableDiff)を返す
+    blob が同じなら読み込まずに空の差分を返す
+    親コミットのスナップショットがあれば、親コミットのテーブルは
+    必要になったときだけ読む
+    処理したテーブルのスナップショットは次のコミット用に保存する
+    """
+    sha = blob_sha(filename, cid)
+    prev_sha = blob_sha(filename, cid + "^")
+    if sha == prev_sha:
+        return tablediff.EMPTY
+    # 新規の行と変更された行を別のチェックで使うので同じ差分は使い回す
+    memo_key = None
+    if row_filter is None and isinstance(key, str):
+        memo_key = (sha, prev_sha, key)
+        if memo_key in diff_memo:
+            return diff_memo[memo_key]
+    rows = load_file(filename, cid)
+    prev_hashes = snapshot_store.load(prev_sha, key)
+    if prev_hashes is None:
+        logger.debug("no snapshot: %s %s", filename, prev_sha)
+        diff = tablediff.diff_rows(rows, load_file(filename, cid + "^"),
+                                   key=key, row_filter=row_filter)
+        if isinstance(key, str):
+            hashes = tablediff.group_fingerprints(
+                tablediff.group_rows(rows, key))
+            snapshot_store.save(sha, key, hashes)
+    else:
+        diff, hashes = tablediff.diff_snapshot(
+            rows, prev_hashes, lambda: load_file(filename, cid + "^"),
+            key=key, row_filter=row_filter)
+        snapshot_store.save(sha, key, hashes)
+    if memo_key is not None:
+        diff_memo[memo_key] = diff
+    return diff
+
+
+def changed_rows(filename, cid, fields, key="id", subkey=None):
+    """
+    cid で内容が変わった既存の行のうち fields の列が変わったものを返す
+    (tablediff.field_changes の結果)
+    指紋が変わった行があるときだけ親コミットのテーブルを読む
+    """
+    diff = diff_table(filename, cid, key=key)
+    if len(diff.changed) == 0:
+        return []
+    return tablediff.field_changes(load_file(filename, cid),
+                                   load_file(filename, cid + "^"),
+                                   diff.changed, fields,
+                                   key=key, subkey=subkey)
+
+
+class MasterData:
+    """
+    1コミット分のテーブルとインデックス
+
+    テーブルは loader(filename, cid) で必要になったときに読み込む
+    同じキーの行が複数ある場合は先頭の行を返す
+    (従来の [... if ...][0] と同じ結果になるように)
+    見つからないときは KeyError
+    """
+    def __init__(self, loader, cid):
+        self.loader = loader
+        self.cid = cid
+        self._indexes = {}
+
+    def table(self, filename):
+        return self.loader(filename, self.cid)
+
+    def index(self, filename, *keys):
+        """
+        キーの値(複数キーならタプル) -> 行 の dict を返す
+        """
+        name = (filename, keys)
+        if name not in self._indexes:
+            idx = {}
+            if len(keys) == 1:
+                key = keys[0]
+                for row in self.table(filename):
+                    idx.setdefault(row[key], row)
+            else:
+                for row in self.table(filename):
+                    idx.setdefault(tuple(row[k] for k in keys), row)
+            logger.debug("index %s %s: %d", filename, keys, len(idx))
+            self._indexes[name] = idx
+        return self._indexes[name]
+
+    def group(self, filename, key):
+        """
+        キーの値 -> 行のリスト(テーブルの並び順) の dict を返す
+        """
+        name = (filename, (key,), "group")
+        if name not in self._indexes:
+            idx = {}
+            for row in self.table(filename):
+                idx.setdefault(row[key], []).append(row)
+            self._indexes[name] = idx
+        return self._indexes[name]
+
+    # サーヴァント
+    def svt(self, svtId):
+        return self.index(mstSvt_file, "id")[svtId]
+
+    def svt_limit(self, svtId, limitCount):
+        return self.index(mstSvtLimit_file,
+                          "svtId", "limitCount")[(svtId, limitCount)]
+
+    def svt_skill_id(self, svtId, num):
+        return self.index(mstSvtSkill_file,
+                          "svtId", "num")[(svtId, num)]["skillId"]
+
+    def svt_skill_by_skill(self, skillId):
+        return self.index(mstSvtSkill_file, "skillId")[skillId]
+
+    def costume(self, costumeCollectionNo):
+        return self.index(mstSvtCostume_file,
+                          "costumeCollectionNo")[costumeCollectionNo]
+
+    # スキル
+    def skill(self, skillId):
+        return self.index(mstSkill_file, "id")[skillId]
+
+    def skill_detail(self, skillId):
+        return self.index(mstSkillDetail_file, "id")[skillId]["detail"]
+
+    def skill_ct(self, skillId, lv=1):
+        return self.index(mstSkillLv_file,
+                          "skillId", "lv")[(skillId, lv)]["chargeTurn"]
+
+    # 宝具
+    def treasure_device(self, treasureDeviceId):
+        return self.index(mstTreasureDevice_file, "id")[treasureDeviceId]
+
+    def treasure_device_by_seq(self, seqId):
+        return self.index(mstTreasureDevice_file, "seqId")[seqId]
+
+    def treasure_device_detail(self, treasureDeviceId):
+        return self.index(mstTreasureDeviceDetail_file,
+                          "id")[treasureDeviceId]["detail"]
+
+    def svt_treasure_device(self, treasureDeviceId):
+        return self.index(mstSvtTreasureDevice_file,
+                          "treasureDeviceId")[treasureDeviceId]
+
+    def svt_treasure_device_by_svt(self, svtId):
+        return self.index(mstSvtTreasureDevice_file, "svtId")[svtId]
+
+    # マスター装備
+    def equip_skill_id(self, equipId, num):
+        return self.index(mstEquipSkill_file,
+                          "equipId", "num")[(equipId, num)]["skillId"]
+
+    def equip_exp(self, equipId):
+        return [e["exp"] for e in self.group(mstEquipExp_file,
+                                             "equipId").get(equipId, [])]
+
+
 def check_datavar(updatefiles, cid="HEAD"):
     """
     アプリバージョンとデータバージョンをチェックする
     """
-    global postCount
     if mstver_file not in updatefiles:
         return
 
@@ -161,16 +551,9 @@ def check_datavar(updatefiles, cid="HEAD"):
     """
     fieleds = []
     if mstEvent_file in updatefiles:
-        # 集合演算で新idだけ抽出
-        mstEvent = load_file(mstEvent_file, cid)
-        event = set([s["id"] for s in mstEvent])
-        mstEvent_prev = json.loads(repo.git.show(cid + "^:" + mstEvent_file))
-        event_prev = set([s["id"] for s in mstEvent_prev])
-        eventIds = list(event - event_prev)
-        logger.debug(eventIds)
-
-        mstEvent_list = [m for m in mstEvent
-                         if m["id"] in eventIds]
+        # 親コミットとの差分で新idだけ抽出
+        mstEvent_list = list(diff_table(mstEvent_file, cid).added.values())
+        logger.debug([m["id"] for m in mstEvent_list])
         # イベントを先に出すようにするためのソート
         mstEvent_list = sorted(mstEvent_list,
                                key=lambda x: x["type"], reverse=True)
@@ -222,8 +605,8 @@ def check_datavar(updatefiles, cid="HEAD"):
                                              + " "
                                              + date_str,
                               "color": 5620992}])
-    postCount += 1
-    info_trouble.getInfoTrouble()
+    # 不具合情報のポーリングはロックの外でバックグラウンドに行う
+    info_trouble.request_poll()
 
 
 def output_gacha(gacha_list):
@@ -231,7 +614,8 @@ def output_gacha(gacha_list):
     ガチャデータを出力する
     """
     # fields の内容を事前作成
-    global postCount
+    if len(gacha_list) == 0:
+        return
     date_items = []
     prev_openedAt = 0
     prev_closedAt = 0
@@ -282,7 +666,6 @@ def output_gacha(gacha_list):
                                         "url": thumb_url
                                         },
                           "color": 5620992}])
-    postCount += 1
 
 
 def check_gacha(updatefiles, cid="HEAD"):
@@ -291,30 +674,20 @@ def check_gacha(updatefiles, cid="HEAD"):
     """
     if mstGacha_file not in updatefiles:
         return
-    # 集合演算で新idだけ抽出
-    mstGacha = load_file(mstGacha_file, cid)
-    gacha = set([g["id"] for g in mstGacha])
-    mstGacha_prev = json.loads(repo.git.show(cid + "^:" + mstGacha_file))
-    gacha_prev = set([g["id"] for g in mstGacha_prev])
-    gachaIds = list(gacha - gacha_prev)
-
-    mstGacha_list = [g for g in mstGacha
-                     if g["id"] in gachaIds]
+    # 親コミットとの差分で新idだけ抽出
+    mstGacha_list = diff_table(mstGacha_file, cid).added.values()
     mstGacha_list = sorted(mstGacha_list, key=lambda x: x['openedAt'])
     logger.debug("mstGacha_list: %s", mstGacha_list)
     output_gacha(mstGacha_list)
 
 
-def make_svtStatus(svt, mstSvtLimit, spoiler=False):
+def make_svtStatus(svt, spoiler=False):
     """
     サーヴァントのステータスを作成
     """
-    hp = [s["hpMax"] for s in mstSvtLimit
-          if s["svtId"] == svt["id"]
-          and s["limitCount"] == 4][0]
-    atk = [s["atkMax"] for s in mstSvtLimit
-           if s["svtId"] == svt["id"]
-           and s["limitCount"] == 4][0]
+    limit = master.svt_limit(svt["id"], 4)
+    hp = limit["hpMax"]
+    atk = limit["atkMax"]
     desp = "**ステータス**\n"
     if spoiler:
         desp += "HP " + '||{:,}||'.format(hp) \
@@ -330,44 +703,25 @@ def make_svtStatus(svt, mstSvtLimit, spoiler=False):
     return desp
 
 
-def make_svtSkills(svt, mstSvtSkill):
+def make_svtSkills(svt):
     """
     サーヴァントのスキルを作成
     """
     desp = "**保有スキル:**\n"
     try:
         # 敵データなどで存在するときにコケるので try except
-        skill1_id = [s["skillId"] for s in mstSvtSkill
-                     if s["svtId"] == svt["id"] and s["num"] == 1][0]
-        skill2_id = [s["skillId"] for s in mstSvtSkill
-                     if s["svtId"] == svt["id"] and s["num"] == 2][0]
-        skill3_id = [s["skillId"] for s in mstSvtSkill
-                     if s["svtId"] == svt["id"] and s["num"] == 3][0]
-        skill1_ct = [s["chargeTurn"] for s in mstSkillLv
-                     if s["skillId"] == skill1_id and s["lv"] == 1][0]
-        skill2_ct = [s["chargeTurn"] for s in mstSkillLv
-                     if s["skillId"] == skill2_id and s["lv"] == 1][0]
-        skill3_ct = [s["chargeTurn"] for s in mstSkillLv
-                     if s["skillId"] == skill3_id and s["lv"] == 1][0]
+        skill_ids = [master.svt_skill_id(svt["id"], num) for num in (1, 2, 3)]
+        skill_cts = [master.skill_ct(skill_id) for skill_id in skill_ids]
 
         # 保有スキルを出力
-        desp += "__スキル1__ チャージタイム||" + str(skill1_ct) + "\n"
-        desp += [k["name"] for k in mstSkill
-                 if k["id"] == skill1_id][0] + "\n"
-        desp += [i["detail"] for i in mstSkillDetail
-                 if i["id"] == skill1_id][0].replace("[{0}]", r"\[Lv\]") + "||"
-        desp += "\n\n"
-        desp += "__スキル2__ チャージタイム||" + str(skill2_ct) + "\n"
-        desp += [k["name"] for k in mstSkill
-                 if k["id"] == skill2_id][0] + "\n"
-        desp += [i["detail"] for i in mstSkillDetail
-                 if i["id"] == skill2_id][0].replace("[{0}]", r"\[Lv\]") + "||"
-        desp += "\n\n"
-        desp += "__スキル3__ チャージタイム||" + str(skill3_ct) + "\n"
-        desp += [k["name"] for k in mstSkill
-                 if k["id"] == skill3_id][0] + "\n"
-        desp += [i["detail"] for i in mstSkillDetail
-                 if i["id"] == skill3_id][0].replace("[{0}]", r"\[Lv\]") + "||"
+        for i, (skill_id, skill_ct) in enumerate(zip(skill_ids, skill_cts)):
+            if i > 0:
+                desp += "\n\n"
+            desp += "__スキル" + str(i + 1) + "__ チャージタイム||" \
+                    + str(skill_ct) + "\n"
+            desp += master.skill(skill_id)["name"] + "\n"
+            desp += master.skill_detail(skill_id).replace("[{0}]",
+                                                          r"\[Lv\]") + "||"
     except Exception as e:
         logger.exception(e)
 
@@ -383,9 +737,8 @@ def make_svtClassSkill(svt):
     desp = "**クラススキル:**\n"
     desp += "||"
     for skillId in svt["classPassive"]:
-        desp += [s["name"] for s in mstSkill if s["id"] == skillId][0] + '\n'
-        desp += [i["detail"] for i in mstSkillDetail
-                 if i["id"] == skillId][0].replace("{0}", "Lv")
+        desp += master.skill(skillId)["name"] + '\n'
+        desp += master.skill_detail(skillId).replace("{0}", "Lv")
         desp += "\n\n"
     desp += "||"
 
@@ -394,30 +747,26 @@ def make_svtClassSkill(svt):
     return desp
 
 
-def make_np(svt, mstTreasureDevice, mstTreasureDeviceDetail,
-            mstSvtTreasureDevice, spoiler=False):
+def make_np(svt, spoiler=False):
     """
     サーヴァントの宝具を作成
     """
     desp = "**宝具:**\n"
     if spoiler:
         desp += "||"
-    np = [np for np in mstTreasureDevice if np["seqId"] == svt["id"]][0]
+    np = master.treasure_device_by_seq(svt["id"])
     desp += np["name"]
     desp += "(" + np["ruby"] + ")" + " " \
-            + id2card_long[[mstd["cardId"] for mstd in mstSvtTreasureDevice
-                            if mstd["treasureDeviceId"] == np["id"]][0]] + "\n"
+            + id2card_long[master.svt_treasure_device(np["id"])["cardId"]] \
+            + "\n"
     desp += "__ランク__ " + np["rank"] + "\n"
     desp += "__種別__ " + np["typeText"] + "\n"
+    np_detail = master.treasure_device_detail(np["id"]).replace("[{0}]",
+                                                                "[Lv]")
     if spoiler:
-        desp += [n["detail"] for n in mstTreasureDeviceDetail
-                 if n["id"] == np["id"]][0].replace("[{0}]",
-                                                    "[Lv]") + "||" + "\n"
+        desp += np_detail + "||" + "\n"
     else:
-        desp += "```" \
-                + [n["detail"] for n in mstTreasureDeviceDetail
-                   if n["id"] == np["id"]][0].replace("[{0}]", "[Lv]") \
-                + "```" + "\n"
+        desp += "```" + np_detail + "```" + "\n"
     desp += "\n"
     return desp
 
@@ -426,30 +775,17 @@ def check_svt(updatefiles, cid="HEAD"):
     """
     サーヴァントをチェックする
     """
-    global postCount
     if mstSvt_file not in updatefiles:
         return
-    mstSvtLimit = load_file(mstSvtLimit_file, cid)
-    mstSvtSkill = load_file(mstSvtSkill_file, cid)
-    mstTreasureDevice = load_file(mstTreasureDevice_file, cid)
-    mstTreasureDeviceDetail = load_file(mstTreasureDeviceDetail_file, cid)
-    mstSvtTreasureDevice = load_file(mstSvtTreasureDevice_file, cid)
-    # 集合演算で新idだけ抽出
-    mstSvt = load_file(mstSvt_file, cid)
-    svt = set([s["id"] for s in mstSvt if (s["type"] == 1 or s["type"] == 2)])
-    mstSvt_prev = json.loads(repo.git.show(cid + "^:" + mstSvt_file))
-    svt_prev = set([s["id"] for s in mstSvt_prev
-                    if (s["type"] == 1 or s["type"] == 2)])
-    gachaIds = list(svt - svt_prev)
-    logger.debug(gachaIds)
-
-    mstSvt_list1 = [q for q in mstSvt
-                    if (q["type"] == 1 or q["type"] == 2)
-                    and q["id"] in gachaIds and q["collectionNo"] != 0]
+    # 親コミットとの差分で新idだけ抽出
+    newSvts = diff_table(mstSvt_file, cid,
+                         row_filter=lambda s: s["type"] == 1
+                         or s["type"] == 2).added
+    logger.debug(list(newSvts))
+
+    mstSvt_list1 = [q for q in newSvts.values() if q["collectionNo"] != 0]
     mstSvt_list1 = sorted(mstSvt_list1, key=lambda x: x['collectionNo'])
-    mstSvt_list2 = [q for q in mstSvt
-                    if (q["type"] == 1 or q["type"] == 2)
-                    and q["id"] in gachaIds and q["collectionNo"] == 0]
+    mstSvt_list2 = [q for q in newSvts.values() if q["collectionNo"] == 0]
     mstSvt_list = mstSvt_list1 + mstSvt_list2
     logger.debug("mstSvt_list: %s", mstSvt_list)
     for svt in mstSvt_list:
@@ -474,11 +810,10 @@ def check_svt(updatefiles, cid="HEAD"):
                 spoiler = True
             else:
                 spoiler = False
-            desp += make_svtStatus(svt, mstSvtLimit, spoiler=spoiler)
-            desp += make_svtSkills(svt, mstSvtSkill)
+            desp += make_svtStatus(svt, spoiler=spoiler)
+            desp += make_svtSkills(svt)
             desp += make_svtClassSkill(svt)
-            desp += make_np(svt, mstTreasureDevice, mstTreasureDeviceDetail,
-                            mstSvtTreasureDevice, spoiler=spoiler)
+            desp += make_np(svt, spoiler=spoiler)
             desp += "**コマンドカード:**\n"
             desp += "||" + cards + "||"
             if 0 < svt["cost"] < 7:
@@ -501,7 +836,6 @@ def check_svt(updatefiles, cid="HEAD"):
                                                 },
                                   "description": desp,
                                   "color": 5620992}])
-            postCount += 1
         except Exception as e:
             logger.exception(e)
             continue
@@ -511,34 +845,28 @@ def check_strengthen(updatefiles, cid="HEAD"):
     """
     強化をチェックする
     """
-    global postCount
+    if mstTreasureDevice_file not in updatefiles \
+       and mstSkill_file not in updatefiles:
+        return
     face_icon = -1
     np_desc = ""
+    mstSvt_dic = {q["id"]: q for q in master.table(mstSvt_file)
+                  if (q["type"] == 1 or q["type"] == 2)
+                  and q["id"] and q["collectionNo"] != 0}
     if mstTreasureDevice_file in updatefiles:
-        # 集合演算で新idだけ抽出
-        mstSvt_list = [q for q in mstSvt
-                       if (q["type"] == 1 or q["type"] == 2)
-                       and q["id"] and q["collectionNo"] != 0]
+        # 親コミットとの差分で新idだけ抽出
         mstSvtNp = load_file(mstSvtTreasureDevice_file, cid)
-        svtNp = [n["treasureDeviceId"] for n in mstSvtNp
-                 if n["priority"] > 101]
-
-        mstNp = load_file(mstTreasureDevice_file, cid)
-        np = set([s["id"] for s in mstNp if s["id"] in svtNp])
-        mstNp_prev = json.loads(repo.git.show(cid + "^:"
-                                              + mstTreasureDevice_file))
-        np_prev = set([s["id"] for s in mstNp_prev if s["id"] in svtNp])
-        npIds = list(np - np_prev)
+        svtNp = set(n["treasureDeviceId"] for n in mstSvtNp
+                    if n["priority"] > 101)
+        npIds = list(diff_table(mstTreasureDevice_file, cid,
+                                row_filter=lambda s: s["id"] in svtNp).added)
         logger.debug(npIds)
         # # fields作成
-        mstNpDetail = load_file(mstTreasureDeviceDetail_file, cid)
-
         for npId in npIds:
-            svtId = [s["svtId"] for s in mstSvtNp
-                     if s["treasureDeviceId"] == npId][0]
+            svtId = master.svt_treasure_device(npId)["svtId"]
             logger.debug(svtId)
             try:
-                svt = [s for s in mstSvt_list if s["id"] == svtId][0]
+                svt = mstSvt_dic[svtId]
                 if face_icon == -1:
                     face_icon = svtId
             except Exception as e:
@@ -550,15 +878,14 @@ def check_strengthen(updatefiles, cid="HEAD"):
             np_desc += id2class[svt["classId"]] + ' ' + svt["name"] + "\n"
 
             # 宝具を出力
-            np_desc += "[" + [n["name"] + "(" + n["ruby"] + ")" for n in mstNp
-                              if n["id"] == npId][0] + "]"
+            td = master.treasure_device(npId)
+            np_desc += "[" + td["name"] + "(" + td["ruby"] + ")" + "]"
             np_desc += "(" + "https://apps.atlasacademy.io/db/#/JP/servant/"
             np_desc += str(svt["collectionNo"]) + "/noble-phantasms" + ")"
-            np_desc += " " + id2card_long[[np["cardId"] for np in mstSvtNp
-                                           if np["svtId"] == svtId][0]] + "\n"
+            np_desc += " " + id2card_long[
+                master.svt_treasure_device_by_svt(svtId)["cardId"]] + "\n"
         #     value += "チャージタイム" + str(skill_ct) + "\n"
-            np_desc += [n["detail"] for n in mstNpDetail
-                        if n["id"] == npId][0].replace("[{0}]", r"\[Lv\]").replace("[g][o]▲[/o][/g]", ":small_red_triangle:")
+            np_desc += master.treasure_device_detail(npId).replace("[{0}]", r"\[Lv\]").replace("[g][o]▲[/o][/g]", ":small_red_triangle:")
             np_desc += '\n\n'
         if len(np_desc) > 0:
             np_desc = "**宝具強化**\n" + np_desc + "\n"
@@ -568,33 +895,20 @@ def check_strengthen(updatefiles, cid="HEAD"):
     """
     skill_desc = ""
     if mstSkill_file in updatefiles:
-        # 集合演算で新idだけ抽出
-        mstSvt_list = [q for q in mstSvt
-                       if (q["type"] == 1 or q["type"] == 2)
-                       and q["id"] and q["collectionNo"] != 0]
-        mstSvtId_list = [q["id"] for q in mstSvt
-                         if (q["type"] == 1 or q["type"] == 2)
-                         and q["id"] and q["collectionNo"] != 0]
-        mstSvtSkill = load_file(mstSvtSkill_file, cid)
-        svtSkill = set([s["skillId"] for s in mstSvtSkill
-                        if s["svtId"] in mstSvtId_list and s["priority"] > 1])
-        mstSvtSkill_prev = json.loads(repo.git.show(cid + "^:"
-                                                    + mstSvtSkill_file))
-        svtSkill_prev = set([s["skillId"] for s in mstSvtSkill_prev
-                             if s["svtId"] in mstSvtId_list
-                             and s["priority"] > 1])
-        svtSkillIds = list(svtSkill - svtSkill_prev)
+        # 親コミットとの差分で新idだけ抽出
+        svtSkillIds = list(diff_table(mstSvtSkill_file, cid, key="skillId",
+                                      row_filter=lambda s:
+                                      s["svtId"] in mstSvt_dic
+                                      and s["priority"] > 1).added)
         logger.debug(svtSkillIds)
         # fields作成
         for svtSkill in svtSkillIds:
-            skill_ct = [s["chargeTurn"] for s in mstSkillLv
-                        if s["skillId"] == svtSkill and s["lv"] == 1][0]
+            skill_ct = master.skill_ct(svtSkill)
             # skillId から servert id
-            svtId = [s["svtId"] for s in mstSvtSkill
-                     if s["skillId"] == svtSkill][0]
+            svtId = master.svt_skill_by_skill(svtSkill)["svtId"]
             logger.debug(svtId)
             try:
-                svt = [s for s in mstSvt_list if s["id"] == svtId][0]
+                svt = mstSvt_dic[svtId]
                 if face_icon == -1:
                     face_icon = svtId
             except Exception as e:
@@ -606,16 +920,13 @@ def check_strengthen(updatefiles, cid="HEAD"):
             skill_desc += id2class[svt["classId"]] + ' ' + svt["name"] + "\n"
 
             # 保有スキルを出力
-            skill_desc += "[" + [k["name"] for k in mstSkill
-                                 if k["id"] == svtSkill][0] + "]"
-            skillNum = [s["skillNum"] for s in mstSvtSkill
-                        if s["skillId"] == svtSkill][0]
+            skill_desc += "[" + master.skill(svtSkill)["name"] + "]"
+            skillNum = master.svt_skill_by_skill(svtSkill)["skillNum"]
             skill_desc += "(" + "https://apps.atlasacademy.io/db/#/JP/servant/"
             skill_desc += str(svt["collectionNo"]) + "/skill-" + str(skillNum)
             skill_desc += ") "
             skill_desc += "チャージタイム" + str(skill_ct) + "\n"
-            skill_desc += [i["detail"] for i in mstSkillDetail
-                           if i["id"] == svtSkill][0].replace("[{0}]", r"\[Lv\]").replace("[g][o]▲[/o][/g]", ":small_red_triangle:")
+            skill_desc += master.skill_detail(svtSkill).replace("[{0}]", r"\[Lv\]").replace("[g][o]▲[/o][/g]", ":small_red_triangle:")
             skill_desc += '\n\n'
         if len(skill_desc) > 0:
             skill_desc = "**スキル強化**\n" + skill_desc
@@ -631,11 +942,9 @@ def check_strengthen(updatefiles, cid="HEAD"):
                                             },
                               "description": np_desc + skill_desc,
                               "color": 5620992}])
-        postCount += 1
 
 
 def output_quest(q_list, title):
-    global postCount
     # fields の内容を事前作成
     date_items = []
     prev_openedAt = 0
@@ -685,32 +994,73 @@ def output_quest(q_list, title):
                                 "title": title + "更新",
                                 "fields": fields,
                                 "color": 5620992}])
-        postCount += 1
 
 
-def questId2consumeItem(questId: int, cid: str) -> str:
-    """questIdからそのクエストの消費アイテムを返す
+# id -> 名前 の索引 (コミットをまたいで保存し、変わったテーブルだけ反映する)
+name_sources = {"item": mstItem_file, "svt": mstSvt_file,
+                "cc": mstCommandCode_file, "quest": mstQuest_file}
+name_index = nameindex.NameIndex(state_dir / "names", name_sources,
+                                 blob_sha, diff_table, load_projection)
+item_name_kinds = ("item", "svt", "cc")
 
-    :param questId: クエストの固有ID
-    :type questId: int
-    :return: アイテム名
-    :rtype: str
+
+def item_names(cid):
     """
-    global id2itemName
-    if len(id2itemName) == 0:
-        mstItem = load_file(mstItem_file, cid)
-        mstSvt = load_file(mstSvt_file, cid)
-        mstCommandCode = load_file(mstCommandCode_file, cid)
-        id2itemName = {item["id"]: item["name"] for item in mstItem}
-        id2itemName.update({item["id"]: item["name"] for item in mstSvt})
-        id2itemName.update({item["id"]: item["name"]
-                            for item in mstCommandCode})
-    mstQuestConsumeItem_list = load_file(mstQuestConsumeItem_file, cid)
-    consumeItem = [q["itemIds"][0]
-                    for q in mstQuestConsumeItem_list
-                    if q["questId"] == questId][0]
-    consume_item = id2itemName[consumeItem]
-    return consume_item
+    アイテム・サーヴァント・コマンドコードの id -> 名前
+    """
+    return name_index.names(cid, *item_name_kinds)
+
+
+# output_quest に渡すクエストの行 (openedAt・closedAt 以外を表示する)
+QuestRecord = namedtuple("QuestRecord",
+                         ["id", "name", "level", "consume", "enemy",
+                          "openedAt", "closedAt"])
+
+
+def enrich_quests(quests, cid):
+    """
+    新しいクエストに viewQuestInfo・mstQuestPhase・mstQuestConsumeItem を結合して
+    (QuestRecord, viewQuestInfo にあるか) のリストにする
+    出力しないクエスト(viewQuestInfo に無く高難易度でもないもの)は除く
+    各テーブルは1回だけ、新しいクエストの行の必要な列だけを読む
+    """
+    questIds = set(q["id"] for q in quests)
+    infoIds = set(qid for qid, in load_projection(
+        mstQuestInfo_file, cid, ["questId"],
+        lambda q: q["questId"] in questIds))
+    # 出力しないクエストは消費アイテムの行が無いことがあるので先に除く
+    quests = [q for q in quests
+              if q["id"] in infoIds or "高難易度" in q["name"]]
+    questIds = set(q["id"] for q in quests)
+    # フェイズが複数あれば最後のフェイズの敵
+    questId2classIds = dict(load_projection(
+        mstQuestPhase_file, cid, ["questId", "classIds"],
+        lambda q: q["questId"] in questIds))
+    # アイテムを消費するクエストだけ消費アイテムを引く
+    itemQuestIds = set(q["id"] for q in quests if q["consumeType"] == 3)
+    questId2itemId = {}
+    if len(itemQuestIds) > 0:
+        for qid, itemIds in load_projection(
+                mstQuestConsumeItem_file, cid, ["questId", "itemIds"],
+                lambda q: q["questId"] in itemQuestIds):
+            questId2itemId.setdefault(qid, itemIds[0])
+        id2itemName = item_names(cid)
+
+    records = []
+    for quest in quests:
+        if quest["id"] in itemQuestIds:
+            consume_item = id2itemName.get(questId2itemId.get(quest["id"]),
+                                           "アイテム")
+        else:
+            consume_item = "AP"
+        record = QuestRecord(quest["id"], quest["name"],
+                             'Lv' + quest["recommendLv"],
+                             consume_item + str(quest["actConsume"]),
+                             list2class(questId2classIds.get(quest["id"], "")),
+                             quest["openedAt"],
+                             quest["closedAt"])
+        records.append((record, quest["id"] in infoIds))
+    return records
 
 
 def check_quests(updatefiles, cid="HEAD"):
@@ -719,68 +1069,21 @@ def check_quests(updatefiles, cid="HEAD"):
     """
     if mstQuest_file not in updatefiles:
         return
-    # 集合演算で新idだけ抽出
-    mstQuest = load_file(mstQuest_file, cid)
-    quest = set([s["id"] for s in mstQuest])
-    mstQuest_prev = json.loads(repo.git.show(cid + "^:" + mstQuest_file))
-    quest_prev = set([s["id"] for s in mstQuest_prev])
-    questIds = list(quest - quest_prev)
-    logger.debug(questIds)
-
-    mstQuest_list = [q for q in mstQuest if q["id"] in questIds
-                     if q["type"] != 7]
+    # 親コミットとの差分で新idだけ抽出
+    newQuests = diff_table(mstQuest_file, cid).added
+    logger.debug(list(newQuests))
+
+    mstQuest_list = [q for q in newQuests.values() if is_notice_quest(q)]
     mstQuest_list = sorted(mstQuest_list, key=lambda x: x['openedAt'])
 
-    mstQuestInfo_list = load_file(mstQuestInfo_file, cid)
-    mstQuestPhase_list = load_file(mstQuestPhase_file, cid)
-    questId2classIds = {q["questId"]: q["classIds"]
-                        for q in mstQuestPhase_list}
     q_list = []
     fq_list = []
-    for quest in mstQuest_list:
-        if not (93000000 < quest["id"] < 100000000):
-            continue
-        if "種火集め" in quest["name"] or "宝物庫" in quest["name"] \
-           or "修練場" in quest["name"]:
-            continue
-        if "高難易度" in quest["name"]:
-            enemy = questId2classIds[quest["id"]]
-            if quest["consumeType"] == 3:
-                consume_item = questId2consumeItem(quest["questId"], cid)
-            else:
-                consume_item = "AP"
-            q_list.append([quest["id"], quest["name"],
-                           'Lv' + quest["recommendLv"],
-                           consume_item + str(quest["actConsume"]),
-                           list2class(enemy),
-                           quest["openedAt"],
-                           quest["closedAt"]])
-            continue
-        for q in mstQuestInfo_list:
-            if q["questId"] == quest["id"]:
-                if quest["consumeType"] == 3:
-                    consume_item = questId2consumeItem(q["questId"], cid)
-                else:
-                    consume_item = "AP"
-                if quest["id"] not in questId2classIds.keys():
-                    enemy = ""
-                else:
-                    enemy = questId2classIds[quest["id"]]
-                if quest["id"] > 94000000:
-                    q_list.append([quest["id"], quest["name"],
-                                   'Lv' + quest["recommendLv"],
-                                   consume_item + str(quest["actConsume"]),
-                                   list2class(enemy),
-                                   quest["openedAt"],
-                                   quest["closedAt"]])
-                else:
-                    fq_list.append([quest["id"], quest["name"],
-                                    'Lv' + quest["recommendLv"],
-                                    consume_item + str(quest["actConsume"]),
-                                    list2class(enemy),
-                                    quest["openedAt"],
-                                    quest["closedAt"]])
-                break
+    for record, _ in enrich_quests(mstQuest_list, cid):
+        # 高難易度は viewQuestInfo に無くても出力する
+        if "高難易度" in record.name or record.id > 94000000:
+            q_list.append(record)
+        else:
+            fq_list.append(record)
 
     logger.debug(q_list)
     logger.debug(fq_list)
@@ -795,48 +1098,25 @@ def check_missionCondition(updatefiles, cid="HEAD"):
     mstEventMissonCondition->"targetIds"8031014 "missionId": 8031015,
     mstEventMissonConditionDetail "id": 8031014 "targetIds":(アイテム、クエスト)
     """
-    global postCount
-    global id2itemName
     if mstEventMissionCondition_file not in updatefiles:
         return
-    if len(id2itemName) == 0:
-        mstItem = load_file(mstItem_file, cid)
-        mstSvt = load_file(mstSvt_file, cid)
-        mstCommandCode = load_file(mstCommandCode_file, cid)
-        id2itemName = {item["id"]: item["name"] for item in mstItem}
-        id2itemName.update({item["id"]: item["name"] for item in mstSvt})
-        id2itemName.update({item["id"]: item["name"]
-                            for item in mstCommandCode})
-    mstQuest = load_file(mstQuest_file, cid)
-    id2itemName4mc = id2itemName.copy()
-    id2itemName4mc.update({item["id"]: item["name"] for item in mstQuest})
+    # ターゲットはアイテムかクエスト
+    id2itemName4mc = name_index.names(cid, *item_name_kinds, "quest")
 
     mEM = load_file(mstEventMission_file, cid)
     id2type = {m["id"]: m["type"] for m in mEM}
-    # 集合演算で新idだけ抽出
-    mEMC = load_file(mstEventMissionCondition_file, cid)
-    EMC = set([s["id"] for s in mEMC
-               if s["targetIds"] != [0]
-               and int(s["targetIds"][0]/100) != 30000
-               and (s["condType"] == 22 or s["condType"] == 2)
-               and id2type[s["missionId"]] == 6
-               ])
-    mEMC_prev = json.loads(repo.git.show(cid + "^:"
-                           + mstEventMissionCondition_file))
-    EMC_prev = set([s["id"] for s in mEMC_prev
-                    if s["targetIds"] != [0]
-                    and int(s["targetIds"][0]/100) != 30000
-                    and (s["condType"] == 22 or s["condType"] == 2)
-                    and id2type[s["missionId"]] == 6
-                    ])
-    EMCIds = list(EMC - EMC_prev)
-    logger.debug(EMCIds)
+    # 親コミットとの差分で新idだけ抽出
+    newEMC = diff_table(mstEventMissionCondition_file, cid,
+                        row_filter=lambda s: s["targetIds"] != [0]
+                        and int(s["targetIds"][0]/100) != 30000
+                        and (s["condType"] == 22 or s["condType"] == 2)
+                        and id2type[s["missionId"]] == 6).added
+    logger.debug(list(newEMC))
 
     mEMCd = load_file(mstEventMissionConditionDetail_file, cid)
 
     fields = []
-    for EMCId in EMCIds:
-        mission = [m for m in mEMC if m["id"] == EMCId][0]
+    for mission in newEMC.values():
         name = mission["conditionMessage"]
         targetIds = [m['targetIds'] for m in mEMCd
                      if mission["targetIds"][0] == m["id"]][0]
@@ -855,14 +1135,12 @@ def check_missionCondition(updatefiles, cid="HEAD"):
                             "title": "ミッション条件更新",
                             "fields": fields,
                             "color": 5620992}])
-        postCount += 1
 
 
 def check_mastermissions(EM_list):
     """
     マスターミッションをチェックする
     """
-    global postCount
     if len(EM_list) != 0:
         thumb_url = aa_url + "/GameData/JP/Items/16.png"
         sdate = str(datetime.fromtimestamp(EM_list[0]["startedAt"]))
@@ -884,14 +1162,12 @@ def check_mastermissions(EM_list):
                                           }
                                          ],
                               "color": 5620992}])
-        postCount += 1
 
 
 def check_eventmissions(EML_list):
     """
     イベントミッションをチェックする
     """
-    global postCount
     if len(EML_list) != 0:
         sdate = str(datetime.fromtimestamp(EML_list[0]["startedAt"]))
         edate = str(datetime.fromtimestamp(EML_list[0]["endedAt"]))
@@ -910,14 +1186,12 @@ def check_eventmissions(EML_list):
                                     }
                                 ],
                                 "color": 5620992}])
-        postCount += 1
 
 
 def check_dailymissions(EMD_list):
     """
     デイリーミッションをチェックする
     """
-    global postCount
     if len(EMD_list) != 0:
         thumb_url = aa_url + "/GameData/JP/Items/7.png"
         sdate = str(datetime.fromtimestamp(EMD_list[0]["startedAt"]))
@@ -940,7 +1214,6 @@ def check_dailymissions(EMD_list):
                                     }
                                 ],
                                 "color": 5620992}])
-        postCount += 1
 
 
 def check_raddermissions(RM_list, cid):
@@ -948,19 +1221,8 @@ def check_raddermissions(RM_list, cid):
     イベントミッション(はしご式)をチェックする
     Discord の文字制限2000字を超えるのでファイルで出力
     """
-    global postCount
-    # 一時ファイルをつくらないで投稿する方法が良く分からないのでtempfileを使用
-
     if len(RM_list) != 0:
-        global id2itemName
-        if len(id2itemName) == 0:
-            mstItem = load_file(mstItem_file, cid)
-            mstSvt = load_file(mstSvt_file, cid)
-            mstCommandCode = load_file(mstCommandCode_file, cid)
-            id2itemName = {item["id"]: item["name"] for item in mstItem}
-            id2itemName.update({item["id"]: item["name"] for item in mstSvt})
-            id2itemName.update({item["id"]: item["name"]
-                                for item in mstCommandCode})
+        id2itemName = item_names(cid)
 
         pattern1 = r"(?P<month>[0-9]{1,2})/(?P<day>[0-9]{1,2})"
         pattern2 = r"(?P<hour>([0-9]|[01][0-9]|2[0-3])):(?P<min>[0-5][0-9])"
@@ -999,6 +1261,8 @@ def check_raddermissions(RM_list, cid):
         # "conditionMessage" で振り分け
         new_list = []
         for em in RM_list:
+            # テーブルはコミット間で共有しているので書き換えない
+            em = dict(em)
             cond = mCondition[em["id"]]
             m1 = re.search(pattern, cond)
             if m1:
@@ -1028,18 +1292,13 @@ def check_raddermissions(RM_list, cid):
             s += mCondition_final[l["id"]]
             s += '\n'
 
-        tmpdir = tempfile.TemporaryDirectory()
         # 日本語のファイル名には対応していない
-        savefile = os.path.join(tmpdir.name, 'Event Mission List.txt')
-        with open(savefile, mode='w', encoding="UTF-8") as f:
-            f.write(s)
         discord.post(username="FGO アップデート",
                      file={
-                           "file1": open(savefile, "rb"),
+                           "file1": delivery.text_file(
+                               'Event Mission List.txt', s),
                            },
                      )
-        tmpdir.cleanup()
-        postCount += 1
 
 
 def check_missions(updatefiles, cid="HEAD"):
@@ -1048,33 +1307,29 @@ def check_missions(updatefiles, cid="HEAD"):
     """
     if mstEventMission_file not in updatefiles:
         return
-    # 集合演算で新idだけ抽出
-    mstEventMission = load_file(mstEventMission_file, cid)
-    event = set([s["id"] for s in mstEventMission])
-    mstEventMission_prev = json.loads(repo.git.show(cid + "^:"
-                                      + mstEventMission_file))
-    event_prev = set([s["id"] for s in mstEventMission_prev])
-    eventMissiontIds = list(event - event_prev)
-    logger.debug(eventMissiontIds)
-
-    mstRadderMission_list = [m for m in mstEventMission
-                             if m["type"] == 1
-                             and m["id"] in eventMissiontIds]
+    # 親コミットとの差分で新idだけ抽出
+    newMissions = diff_table(mstEventMission_file, cid).added
+    logger.debug(list(newMissions))
+
+    mstRadderMission_list = []
+    mstEventMission_list = []
+    mstEventMissionDaily_list = []
+    mstEventMissionLimited_list = []
+    for m in newMissions.values():
+        if m["type"] == 1:
+            mstRadderMission_list.append(m)
+        elif m["type"] == 2:
+            mstEventMission_list.append(m)
+        elif m["type"] == 3:
+            mstEventMissionDaily_list.append(m)
+        else:
+            mstEventMissionLimited_list.append(m)
     mstRadderMission_list = sorted(mstRadderMission_list,
                                    key=lambda x: x["startedAt"])
-    mstEventMission_list = [m for m in mstEventMission
-                            if m["type"] == 2
-                            and m["id"] in eventMissiontIds]
     mstEventMission_list = sorted(mstEventMission_list,
                                   key=lambda x: x['closedAt'])
-    mstEventMissionDaily_list = [m for m in mstEventMission
-                                 if m["type"] == 3
-                                 and m["id"] in eventMissiontIds]
     mstEventMissionDaily_list = sorted(mstEventMissionDaily_list,
                                        key=lambda x: x['closedAt'])
-    mstEventMissionLimited_list = [m for m in mstEventMission
-                                   if m["type"] not in [1, 2, 3]
-                                   and m["id"] in eventMissiontIds]
     mstEventMissionLimited_list = sorted(mstEventMissionLimited_list,
                                          key=lambda x: x['closedAt'])
 
@@ -1084,11 +1339,10 @@ def check_missions(updatefiles, cid="HEAD"):
     check_dailymissions(mstEventMissionDaily_list)
 
 
-def output_shop(shop_list, shopname):
+def output_shop(shop_list, shopname, id2itemName):
     """
     ショップデータを出力する
     """
-    global postCount
     # fields の内容を事前作成
     date_items = []
     prev_openedAt = 0
@@ -1200,7 +1454,6 @@ def output_shop(shop_list, shopname):
                                                 },
                                   "fields": fields,
                                   "color": 5620992}])
-            postCount += 1
         elif shopname == "レアプリズム交換":
             thumb_url = aa_asset_url + "/GameData/JP/Items/18.png"
             discord.post(username="FGO アップデート",
@@ -1211,7 +1464,6 @@ def output_shop(shop_list, shopname):
                                                 },
                                   "fields": fields,
                                   "color": 5620992}])
-            postCount += 1
         else:
             if len(shop_txt.encode("EUC_JP", 'replace')) < 2000 - 70:
                 discord.post(username="FGO アップデート",
@@ -1220,18 +1472,13 @@ def output_shop(shop_list, shopname):
                                     "fields": fields,
                                     "color": 5620992}])
             else:
-                tmpdir = tempfile.TemporaryDirectory()
                 # 日本語のファイル名には対応していない
-                savefile = os.path.join(tmpdir.name, 'Event Shop List.txt')
-                with open(savefile, mode='w', encoding="UTF-8") as f:
-                    f.write(shop_txt)
                 discord.post(username="FGO アップデート",
                             file={
-                                "file1": open(savefile, "rb"),
+                                "file1": delivery.text_file(
+                                    'Event Shop List.txt', shop_txt),
                                 },
                             )
-                tmpdir.cleanup()
-            postCount += 1
 
 
 def check_shop(updatefiles, cid="HEAD"):
@@ -1244,72 +1491,43 @@ def check_shop(updatefiles, cid="HEAD"):
     """
     if mstShop_file not in updatefiles:
         return
-    # 集合演算で新idだけ抽出
-    mstShop = load_file(mstShop_file, cid)
-    shop = set([s["id"] for s in mstShop])
-    mstShop_prev = json.loads(repo.git.show(cid + "^:" + mstShop_file))
-    shop_prev = set([s["id"] for s in mstShop_prev])
-    shopIds = list(shop - shop_prev)
-    logger.debug(shopIds)
-
-    global id2itemName
-    if len(id2itemName) == 0:
-        mstItem = load_file(mstItem_file, cid)
-        mstSvt = load_file(mstSvt_file, cid)
-        mstCommandCode = load_file(mstCommandCode_file, cid)
-        id2itemName = {item["id"]: item["name"] for item in mstItem}
-        id2itemName.update({item["id"]: item["name"] for item in mstSvt})
-        id2itemName.update({item["id"]: item["name"]
-                            for item in mstCommandCode})
-
-    eventShop_list = [m for m in mstShop
-                      if m["shopType"] == 1
-                      and m["id"] in shopIds]
-    eventShop_list = sorted(eventShop_list, key=lambda x: x['closedAt'])
+    # 親コミットとの差分で新idだけ抽出
+    newShops = diff_table(mstShop_file, cid).added
+    logger.debug(list(newShops))
+
+    id2itemName = item_names(cid)
+
+    shop_lists = {1: [], 2: [], 3: [], 8: []}
+    for m in newShops.values():
+        if m["shopType"] in shop_lists:
+            shop_lists[m["shopType"]].append(m)
+    eventShop_list = sorted(shop_lists[1], key=lambda x: x['closedAt'])
     logger.debug("eventShop_list: %s", eventShop_list)
-    manaShop_list = [m for m in mstShop
-                     if m["shopType"] == 2
-                     and m["id"] in shopIds]
-    manaShop_list = sorted(manaShop_list, key=lambda x: x['closedAt'])
+    manaShop_list = sorted(shop_lists[2], key=lambda x: x['closedAt'])
     logger.debug("manaShop_list: %s", manaShop_list)
-    rareShop_list = [m for m in mstShop
-                     if m["shopType"] == 3
-                     and m["id"] in shopIds]
-    rareShop_list = sorted(rareShop_list, key=lambda x: x['closedAt'])
+    rareShop_list = sorted(shop_lists[3], key=lambda x: x['closedAt'])
     logger.debug("rareShop_list: %s", rareShop_list)
-    soundPayer_list = [m for m in mstShop
-                       if m["shopType"] == 8
-                       and m["id"] in shopIds]
+    soundPayer_list = shop_lists[8]
     logger.debug("soundPayer_list: %s", soundPayer_list)
-    output_shop(eventShop_list, "イベントショップ")
-    output_shop(manaShop_list, "マナプリズム交換")
-    output_shop(rareShop_list, "レアプリズム交換")
-    output_shop(soundPayer_list, "サウンドプレイヤー")
+    output_shop(eventShop_list, "イベントショップ", id2itemName)
+    output_shop(manaShop_list, "マナプリズム交換", id2itemName)
+    output_shop(rareShop_list, "レアプリズム交換", id2itemName)
+    output_shop(soundPayer_list, "サウンドプレイヤー", id2itemName)
 
 
 def check_svtfilter(updatefiles, cid="HEAD"):
     """
     サーヴァント強化フィルターの更新チェック
     """
-    global postCount
     if mstSvtFilter_file not in updatefiles:
         return
-    # 集合演算で新idだけ抽出
-    mstSvtFilter = load_file(mstSvtFilter_file, cid)
-    SvtFilter = set([s["id"] for s in mstSvtFilter])
-    mstSvtFilter_prev = json.loads(repo.git.show(cid + "^:"
-                                   + mstSvtFilter_file))
-    SvtFilter_prev = set([s["id"] for s in mstSvtFilter_prev])
-    SvtFilterIds = list(SvtFilter - SvtFilter_prev)
-    logger.debug(SvtFilterIds)
+    # 親コミットとの差分で新idだけ抽出
+    mstSvtFilter_list = list(diff_table(mstSvtFilter_file,
+                                        cid).added.values())
 
     mstSvt_list = [q for q in mstSvt
                    if (q["type"] == 1 or q["type"] == 2)
-                   and q["collectionNo"] not in mstSvt
                    and q["collectionNo"] != 0]
-    mstSvtFilter_list = [m for m in mstSvtFilter
-                         if m["id"] in SvtFilterIds]
-    logger.debug("mstSvtFilter_list: %s", mstSvtFilter_list)
     mstSvtF_dic = {m["id"]: {"name": m["name"],
                              "cost": m["cost"],
                              "classId": m["classId"]} for m in mstSvt_list}
@@ -1340,49 +1558,21 @@ def check_svtfilter(updatefiles, cid="HEAD"):
                                 "title": svtFilter["name"] + "フィルター更新",
                                 "fields": fields,
                                 "color": 5620992}])
-        postCount += 1
 
 
 def plot_equiipExp(name, mc_exp):
     """
     マスター装備の必要経験値をプロットする
     """
-    # ロードに時間がかかり、かつたまにしか実行されないため遅延 import
-    import matplotlib.pyplot as plt
-    global postCount
-    fig = plt.figure()
-    ax = fig.add_subplot(1, 1, 1)
-
-    # 折れ線グラフを出力
-    level = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
-
-    mcChaldea_exp = [0, 10000, 40000, 100000, 220000,
-                     460000, 940000, 1900000, 3820000, 7660000]
-    mcStd_exp = [0, 1569000, 4707000, 9414000, 15690000,
-                 23535000, 32949000, 43932000, 56484000, 70605000]
-    mcLmited_exp = [0, 53000, 132500, 305000, 609000,
-                    1218000, 2200000, 3727000, 5963000, 8950000]
-    mcArctic_exp = [0, 3451800, 10355400, 20710800, 34518000,
-                    51777000, 72487800, 96650400, 124264800, 155331000]
-    ax.plot(level, mcChaldea_exp)
-    ax.plot(level, mcStd_exp)
-    ax.plot(level, mcLmited_exp)
-    ax.plot(level, mcArctic_exp)
-    ax.plot(level, mc_exp, " ", marker='o')
-    ax.set_title('マスター装備必要経験値')
-    ax.set_xlabel('Lv')  # x軸ラベル
-    ax.legend(['魔術礼装･カルデア', '恒常装備', '期間限定装備', '魔術礼装･極地用カルデア制服', name])  # 凡例を表示
-    # 一時ファイルをつくらないで投稿する方法が良く分からないのでtempfileを使用
-    tmpdir = tempfile.TemporaryDirectory()
-    savefile = os.path.join(tmpdir.name, 'mcfig.png')
-    plt.savefig(savefile)
+    # ファイルに書かずにメモリ上の PNG を投稿する
+    png = io.BytesIO()
+    equipchart.render(name, mc_exp, png, backend=chart_backend,
+                      font=chart_font, cache_dir=state_dir)
     discord.post(username="FGO アップデート",
                  file={
-                       "file1": open(savefile, "rb"),
+                       "file1": ('mcfig.png', png.getvalue()),
                        },
                  )
-    tmpdir.cleanup()
-    postCount += 1
 
 
 def check_mstEquip(updatefiles, cid="HEAD"):
@@ -1391,36 +1581,23 @@ def check_mstEquip(updatefiles, cid="HEAD"):
     """
     if mstEquip_file not in updatefiles:
         return
-    global postCount
-    # 集合演算で新idだけ抽出
-    mstEquip = load_file(mstEquip_file, cid)
-    Equip = set([s["id"] for s in mstEquip])
-    mstEquip_prev = json.loads(repo.git.show(cid + "^:" + mstEquip_file))
-    Equip_prev = set([s["id"] for s in mstEquip_prev])
-    equipIds = list(Equip - Equip_prev)
-    logger.debug(equipIds)
-
-    mstEquipExp = load_file(mstEquipExp_file, cid)
-    mstEquipSkill = load_file(mstEquipSkill_file, cid)
-
-    mstEquip_list = [m for m in mstEquip
-                     if m["id"] in equipIds]
+    # 親コミットとの差分で新idだけ抽出
+    mstEquip_list = list(diff_table(mstEquip_file, cid).added.values())
     logger.debug("mstEquip_list: %s", mstEquip_list)
     for equip in mstEquip_list:
-        skill1_id = [s["skillId"] for s in mstEquipSkill
-                     if s["equipId"] == equip["id"] and s["num"] == 1][0]
-        skill2_id = [s["skillId"] for s in mstEquipSkill
-                     if s["equipId"] == equip["id"] and s["num"] == 2][0]
-        skill3_id = [s["skillId"] for s in mstEquipSkill
-                     if s["equipId"] == equip["id"] and s["num"] == 3][0]
-        skill1_ct = [s["chargeTurn"] for s in mstSkillLv
-                     if s["skillId"] == skill1_id and s["lv"] == 1][0]
-        skill2_ct = [s["chargeTurn"] for s in mstSkillLv
-                     if s["skillId"] == skill2_id and s["lv"] == 1][0]
-        skill3_ct = [s["chargeTurn"] for s in mstSkillLv
-                     if s["skillId"] == skill3_id and s["lv"] == 1][0]
-        mc_exp = [0] + [e["exp"] for e in mstEquipExp
-                        if e["equipId"] == equip["id"]][:-1]
+        skill_fields = []
+        for num in (1, 2, 3):
+            skill_id = master.equip_skill_id(equip["id"], num)
+            skill_fields.append({
+                "name": "スキル" + str(num),
+                "value": master.skill(skill_id)["name"]
+                + ' CT' + str(master.skill_ct(skill_id))
+                + '```'
+                + master.skill_detail(skill_id).replace("{0}", "Lv")
+                + '```',
+                "inline": True
+                })
+        mc_exp = [0] + master.equip_exp(equip["id"])[:-1]
         logger.debug("mc_exp: %s", mc_exp)
         discord.post(username="FGO アップデート",
                      embeds=[{
@@ -1430,31 +1607,9 @@ def check_mstEquip(updatefiles, cid="HEAD"):
                                     {
                                      "name": "詳細",
                                      "value": '```' + equip["detail"] + '```'
-                                    },
-                                    {
-                                     "name": "スキル1",
-                                     "value": [k["name"] for k in mstSkill
-                                               if k["id"] == skill1_id
-                                               ][0] + ' CT' + str(skill1_ct) + '```' + [i["detail"] for i in mstSkillDetail if i["id"] == skill1_id][0].replace("{0}", "Lv") + '```',
-                                     "inline": True
-                                    },
-                                    {
-                                        "name": "スキル2",
-                                        "value": [k["name"] for k in mstSkill
-                                                  if k["id"] == skill2_id
-                                                  ][0] + ' CT' + str(skill2_ct) + '```' + [i["detail"] for i in mstSkillDetail if i["id"] == skill2_id][0].replace("{0}", "Lv") + '```',
-                                        "inline": True
-                                    },
-                                    {
-                                        "name": "スキル3",
-                                        "value": [k["name"] for k in mstSkill
-                                                  if k["id"] == skill3_id
-                                                  ][0] + ' CT' + str(skill3_ct) + '```' + [i["detail"] for i in mstSkillDetail if i["id"] == skill3_id][0].replace("{0}", "Lv") + '```',
-                                        "inline": True
                                     }
-                                ],
+                                ] + skill_fields,
                                 "color": 5620992}])
-        postCount += 1
         plot_equiipExp(equip["name"], mc_exp)
 
 
@@ -1464,24 +1619,20 @@ def check_eventReward(updatefiles, cid="HEAD"):
     """
     if mstEventReward_file not in updatefiles:
         return
-    global postCount
-    # 集合演算で新idだけ抽出
     mER = load_file(mstEventReward_file, cid)
-    mER_prev = json.loads(repo.git.show(cid + "^:" + mstEventReward_file))
     mstGift = load_file(mstGift_file, cid)
     giftId2reward = {g["id"]: {"itemId": g["objectId"], "num": g["num"]}
                      for g in mstGift}
     # 新規追加のイベントIDを検出する
-    ER = set([s["eventId"] for s in mER])
-    logger.debug(ER)
-    ER_prev = set([s["eventId"] for s in mER_prev])
-    logger.debug(ER_prev)
-    evIds = list(ER - ER_prev)
-    logger.debug(evIds)
-    for evId in evIds:
+    evIds = diff_table(mstEventReward_file, cid, key="eventId").added
+    logger.debug(list(evIds))
+    id2itemName = item_names(cid)
+    pointRewards = {evId: [] for evId in evIds}
+    for i in mER:
+        if i["eventId"] in pointRewards:
+            pointRewards[i["eventId"]].append((i["point"], i["giftId"]))
+    for evId, pointReward in pointRewards.items():
         description = ""
-        pointReward = [(i["point"], i["giftId"]) for i in mER
-                       if i["eventId"] == evId]
         for p in pointReward:
             description += "{:,}".format(p[0]) + "\t"
             rew = giftId2reward[p[1]]
@@ -1495,23 +1646,18 @@ def check_eventReward(updatefiles, cid="HEAD"):
                                 "description": description,
                                 "color": 5620992}])
         else:
-            tmpdir = tempfile.TemporaryDirectory()
             # 日本語のファイル名には対応していない
-            savefile = os.path.join(tmpdir.name, 'Event Point Reward.txt')
-            with open(savefile, mode='w', encoding="UTF-8") as f:
-                f.write(description)
             discord.post(username="FGO アップデート",
                         file={
-                            "file1": open(savefile, "rb"),
+                            "file1": delivery.text_file(
+                                'Event Point Reward.txt', description),
                             },
                         )
-            tmpdir.cleanup()
         # discord.post(username="FGO アップデート",
         #              embeds=[{
         #                       "title": "ポイント報酬更新",
         #                       "description": description,
         #                       "color": 5620992}])
-        postCount += 1
 
 
 def check_box(updatefiles, cid="HEAD"):
@@ -1520,31 +1666,17 @@ def check_box(updatefiles, cid="HEAD"):
     """
     if mstBoxGacha_file not in updatefiles:
         return
-    global postCount
-    global id2itemName
-    if len(id2itemName.keys()) == 0:
-        mstItem = load_file(mstItem_file, cid)
-        mstSvt = load_file(mstSvt_file, cid)
-        mstCommandCode = load_file(mstCommandCode_file, cid)
-        id2itemName = {item["id"]: item["name"] for item in mstItem}
-        id2itemName.update({item["id"]: item["name"] for item in mstSvt})
-        id2itemName.update({item["id"]: item["name"]
-                            for item in mstCommandCode})
-
-    # 集合演算で新idだけ抽出
-    mstBG = load_file(mstBoxGacha_file, cid)
-    BG = set([s["id"] for s in mstBG])
-    mstBG_prev = json.loads(repo.git.show(cid + "^:" + mstBoxGacha_file))
-    BG_prev = set([s["id"] for s in mstBG_prev])
-    BGIds = list(BG - BG_prev)
-    logger.debug(BGIds)
+    id2itemName = item_names(cid)
+
+    # 親コミットとの差分で新idだけ抽出
+    newBGs = diff_table(mstBoxGacha_file, cid).added
+    logger.debug(list(newBGs))
     mstGift = load_file(mstGift_file, cid)
     giftId2itemId = {i["id"]: i["objectId"] for i in mstGift}
     giftId2itemNum = {i["id"]: i["num"] for i in mstGift}
 
     mstBGB = load_file(mstBoxGachaBase_file, cid)
-    for BG in BGIds:
-        BGdic = [b for b in mstBG if b["id"] == BG][0]
+    for BGdic in newBGs.values():
         description = ":gift:**1回目のラインナップ**\n"
         pLineup = {}
         for i, baseId in enumerate(BGdic["baseIds"]):
@@ -1597,45 +1729,30 @@ def check_box(updatefiles, cid="HEAD"):
                     description += desc_inner
             pLineup = cLineup.copy()
 
-        payTargetId = [bg["payTargetId"] for bg in mstBG if bg["id"] == BG][0]
-        payTarget = id2itemName[payTargetId]
+        payTarget = id2itemName[BGdic["payTargetId"]]
         discord.post(username="FGO アップデート",
                      embeds=[{
                               "title": "【ボックス】" + payTarget
                                        + "交換 プレゼントラインナップ",
                               "description": description,
                               "color": 5620992}])
-        postCount += 1
 
 
 def check_costume(updatefiles, cid="HEAD"):
     """
     霊衣更新を出力する
     """
-    global mstSvt
-    global mstClass
-    global id2class
-    global postCount
     if mstSvtCostume_file not in updatefiles:
         return
-    if len(mstSvt) == 0:
-        mstSvt = load_file(mstSvt_file, args.cid)
-    if len(mstClass) == 0:
-        mstClass = load_file(mstClass_file, args.cid)
-        id2class = {c["id"]: c["name"] for c in mstClass}
-    # 集合演算で新idだけ抽出
-    mSC = load_file(mstSvtCostume_file, cid)
-    SC = set([s["costumeCollectionNo"] for s in mSC])
-    mESC_prev = json.loads(repo.git.show(cid + "^:" + mstSvtCostume_file))
-    ESC_prev = set([s["costumeCollectionNo"] for s in mESC_prev])
-    SCIds = list(SC - ESC_prev)
-    logger.debug(SCIds)
+    # 親コミットとの差分で新idだけ抽出
+    newCostumes = diff_table(mstSvtCostume_file, cid,
+                             key="costumeCollectionNo").added
+    logger.debug(list(newCostumes))
 
     fields = []
     face_icon = -1
-    for SCId in SCIds:
-        costume = [sc for sc in mSC if sc["costumeCollectionNo"] == SCId][0]
-        svt = [s for s in mstSvt if s["id"] == costume["svtId"]][0]
+    for costume in newCostumes.values():
+        svt = master.svt(costume["svtId"])
         if face_icon == -1:
             face_icon = svt["id"]
         name = "No." + str(svt["collectionNo"])
@@ -1651,7 +1768,7 @@ def check_costume(updatefiles, cid="HEAD"):
 
         fields.append({"name": name,
                        "value": value})
-    if len(SCIds) > 0:
+    if len(newCostumes) > 0:
         thumb_url = aa_url + "/GameData/JP/Faces/f_" \
                     + str(face_icon) + "0.png"
         discord.post(username="FGO アップデート",
@@ -1662,7 +1779,139 @@ def check_costume(updatefiles, cid="HEAD"):
                                               },
                                 "fields": fields,
                                 "color": 5620992}])
-        postCount += 1
+
+
+def is_notice_quest(quest):
+    """
+    更新を通知するクエストか
+    """
+    if quest["type"] == 7:
+        return False
+    if not (93000000 < quest["id"] < 100000000):
+        return False
+    if "種火集め" in quest["name"] or "宝物庫" in quest["name"] \
+       or "修練場" in quest["name"]:
+        return False
+    return True
+
+
+def is_svt_skill(skillLv):
+    """
+    プレイアブルサーヴァントのスキルか
+    """
+    svtSkill = master.index(mstSvtSkill_file,
+                            "skillId").get(skillLv["skillId"])
+    if svtSkill is None:
+        return False
+    svt = master.index(mstSvt_file, "id").get(svtSkill["svtId"])
+    return svt is not None and svt["type"] in (1, 2) \
+        and svt["collectionNo"] != 0
+
+
+def svt_skill_name(skillLv):
+    svtId = master.svt_skill_by_skill(skillLv["skillId"])["svtId"]
+    return master.svt(svtId)["name"] + " " \
+        + master.skill(skillLv["skillId"])["name"]
+
+
+# 既存の行の変更を通知するテーブル
+# fields の列が変わった行を通知する filter があれば対象の行を絞る
+change_checks = [
+    {"file": mstGacha_file, "title": "ガチャ",
+     "fields": ["openedAt", "closedAt"]},
+    {"file": mstQuest_file, "title": "クエスト",
+     "fields": ["actConsume", "openedAt", "closedAt"],
+     "filter": is_notice_quest},
+    {"file": mstEvent_file, "title": "イベント",
+     "fields": ["startedAt", "endedAt"]},
+    {"file": mstShop_file, "title": "ショップ",
+     "fields": ["prices", "limitNum", "openedAt", "closedAt"],
+     "filter": lambda s: s["shopType"] in (1, 2, 3)},
+    {"file": mstSkillLv_file, "title": "スキル",
+     "fields": ["chargeTurn"], "key": "skillId", "subkey": "lv",
+     "filter": is_svt_skill, "name": svt_skill_name},
+]
+change_labels = {"openedAt": "開始", "closedAt": "終了",
+                 "startedAt": "開始", "endedAt": "終了",
+                 "actConsume": "消費", "prices": "価格",
+                 "limitNum": "上限", "chargeTurn": "CT"}
+
+
+def change_value(field, value):
+    if value is None:
+        return "-"
+    if field.endswith("At"):
+        return str(datetime.fromtimestamp(value))
+    if isinstance(value, list) and len(value) == 1:
+        return str(value[0])
+    return str(value)
+
+
+def output_changes(entries, title):
+    """
+    変更データを出力する
+    entries は [(名前, 変更内容の行のリスト), ...]
+    変更内容が同じもの(イベント延長でのショップなど)はまとめる
+    """
+    merged = {}
+    for name, lines in entries:
+        # Discord の field の value は1024文字まで
+        value = ""
+        for i, line in enumerate(lines):
+            if len(value) + len(line) > 1024 - 20:
+                value += "他{}件\n".format(len(lines) - i)
+                break
+            value += line + "\n"
+        merged.setdefault(value, []).append(name)
+    fields = []
+    for value, names in merged.items():
+        name = names[0]
+        if len(names) > 1:
+            name += " 他{}件".format(len(names) - 1)
+        fields.append({"name": name[:256],
+                       "value": "```" + value.rstrip("\n") + "```"})
+    logger.debug(fields)
+    # 1つの embed の field は25個まで
+    for i in range(0, len(fields), 25):
+        discord.post(username="FGO アップデート",
+                     embeds=[{
+                                "title": title + "変更",
+                                "fields": fields[i:i + 25],
+                                "color": 5620992}])
+
+
+def check_changes(updatefiles, cid="HEAD"):
+    """
+    既存のデータの変更(期間の延長・消費AP・CTなど)をチェックする
+    """
+    for check in change_checks:
+        if check["file"] not in updatefiles:
+            continue
+        key = check.get("key", "id")
+        subkey = check.get("subkey")
+        row_filter = check.get("filter")
+        get_name = check.get("name",
+                             lambda row: row.get("name", str(row[key])))
+        # 親コミットから内容が変わった行だけ列を比較する
+        results = changed_rows(check["file"], cid, check["fields"],
+                               key=key, subkey=subkey)
+        entries = {}
+        for row, prev_row, changes in results:
+            if row_filter is not None and not row_filter(row):
+                continue
+            k = row[key]
+            if k not in entries:
+                entries[k] = (get_name(row), [])
+            for field, old, new in changes:
+                line = change_labels.get(field, field) + " | " \
+                       + change_value(field, old) + " → " \
+                       + change_value(field, new)
+                if subkey is not None:
+                    line = subkey.capitalize() + str(row[subkey]) \
+                           + " " + line
+                entries[k][1].append(line)
+        logger.debug("%s changes: %s", check["file"], entries)
+        output_changes(list(entries.values()), check["title"])
 
 
 def lock_or_through(func):
@@ -1673,7 +1922,7 @@ def lock_or_through(func):
     def lock(*args, **kwargs):
         lock = None
         try:
-            lock = lockfile.LockFile('lock')
+            lock = lockfile.LockFile(str(lock_f))
         except LockError:
             logger.error("locked")
             discord_error.post(username="FGO アップデート",
@@ -1706,36 +1955,353 @@ def post(func, updatefiles, cid="HEAD"):
                                     "color": 15158332}])
 
 
-@lock_or_through
-def main(args):
-    global postCount
-    if args.cid != "HEAD" or check_update():
-        updatefiles = repo.git.diff(args.cid + '^..'
-                                    + args.cid, name_only=True).split('\n')
-        if mstSvtFilter_file in updatefiles or mstSvt_file in updatefiles:
-            global mstSvt
-            global id2class
-            mstSvt = load_file(mstSvt_file, args.cid)
-            mstClass = load_file(mstClass_file, args.cid)
-            id2class = {c["id"]: c["name"] for c in mstClass}
-        if mstEquip_file in updatefiles or mstSvt_file in updatefiles:
-            # 複数個所で使用するファイルを読んでおく
-            global mstSkill
-            global mstSkillDetail
-            global mstSkillLv
-            global mstFunc
-            mstSkill = load_file(mstSkill_file, args.cid)
-            mstSkillDetail = load_file(mstSkillDetail_file, args.cid)
-            mstSkillLv = load_file(mstSkillLv_file, args.cid)
-            mstFunc = load_file(mstFunc_file, args.cid)
-
-        funcs = [check_gacha, check_svt, check_strengthen, check_quests,
-                 check_missions, check_shop, check_eventReward, check_box,
-                 check_svtfilter, check_mstEquip, check_costume,
-                 check_missionCondition, check_datavar]
+class PostRecorder:
+    """
+    並列実行時にワーカーで Discord の代わりに使う
+    ポストを記録しておき、親プロセスで元の順番どおりに投稿する
+    """
+    def __init__(self, target):
+        self.target = target
+        self.posts = []
+
+    def post(self, **kwargs):
+        file = kwargs.get("file")
+        if file is not None:
+            # 親プロセスに渡せるように (ファイル名, 中身) にしておく
+            kwargs["file"] = delivery.read_files(file)
+        self.posts.append((self.target, kwargs))
+
+
+def init_worker():
+    """
+    fork したワーカーの初期化
+    """
+    global discord
+    global discord_error
+    # 常駐している git cat-file は親プロセスと共有しているので切り離す
+    # (proc を外しておかないと後始末で親プロセスの cat-file を止めてしまう)
+    for cmd in (repo.git.cat_file_all, repo.git.cat_file_header):
+        if cmd:
+            cmd.proc = None
+    repo.git.cat_file_all = None
+    repo.git.cat_file_header = None
+    discord = PostRecorder("main")
+    discord_error = PostRecorder("error")
+
+
+def run_check(func, updatefiles, cid):
+    """
+    ワーカーで1つのチェックを実行してポストのリストを返す
+    """
+    discord.posts = []
+    discord_error.posts = []
+    post(func, updatefiles, cid=cid)
+    return discord.posts + discord_error.posts
+
+
+def replay_posts(posts):
+    """
+    ワーカーで記録したポストを投稿する
+    """
+    targets = {"main": discord, "error": discord_error}
+    for target, kwargs in posts:
+        targets[target].post(**kwargs)
+
+
+def fork_pool(jobs):
+    """
+    fork でワーカーを作るプロセスプール
+    投稿の送信スレッドがキューやログのロックを持ったまま fork すると
+    ワーカーが止まることがあるので、送り切ってスレッドを止めてから作る
+    (fork のプールはワーカーを全て最初に作る)
+    """
+    if runtime.imported("delivery"):
+        delivery.stop()
+    context = multiprocessing.get_context("fork")
+    return ProcessPoolExecutor(max_workers=jobs, mp_context=context,
+                               initializer=init_worker)
+
+
+def run_parallel(funcs, updatefiles, cid, jobs):
+    """
+    チェックをプロセスプールで並列に実行して、元の順番どおりに投稿する
+    テーブルは fork でワーカーに引き継ぐので、先に親プロセスで読んでおく
+    (process_commit で prefetch してから呼ぶ)
+    """
+    with fork_pool(jobs) as executor:
+        futures = [executor.submit(run_check, func, updatefiles, cid)
+                   for func in funcs]
+        for func, future in zip(funcs, futures):
+            try:
+                posts = future.result()
+            except Exception as e:
+                logger.exception(e)
+                discord_error.post(username="FGO アップデート",
+                                   embeds=[{
+                                            "title": func.__name__ + "Error",
+                                            "description": "Check server log",
+                                            "color": 15158332}])
+                continue
+            replay_posts(posts)
+
+
+def diff_commits(cids):
+    """
+    各コミットの更新ファイル一覧を取得する
+    git diff はコミットごとに独立しているので並列に実行する
+    """
+    def diff(cid):
+        # 部分クローンでは名前の変更の検出に blob の取得が必要になるので
+        # 検出しない(ファイル名の一覧には影響しない)
+        return repo.git.diff(cid + '^..' + cid, name_only=True,
+                             no_renames=True).split('\n')
+
+    if len(cids) <= 1:
+        return [diff(cid) for cid in cids]
+    with ThreadPoolExecutor(max_workers=min(4, len(cids))) as executor:
+        return list(executor.map(diff, cids))
+
+
+def commit_batches(cids, updatefiles_list):
+    """
+    続いていて更新したテーブルが重ならないコミットを [(cid, 更新ファイル), ...] にまとめる
+    mstver.json はどのコミットでも更新されるので重なりには数えない
+    """
+    batches = []
+    tables = set()
+    for cid, updatefiles in zip(cids, updatefiles_list):
+        files = set(updatefiles) - {mstver_file, ""}
+        if len(batches) > 0 and tables.isdisjoint(files):
+            batches[-1].append((cid, updatefiles))
+            tables |= files
+        else:
+            batches.append([(cid, updatefiles)])
+            tables = files
+    return batches
+
+
+def run_commit(cid, updatefiles):
+    """
+    ワーカーで1コミット分のチェックを実行してポストのリストを返す
+    """
+    discord.posts = []
+    discord_error.posts = []
+    process_commit(cid, updatefiles)
+    return discord.posts + discord_error.posts
+
+
+def run_commits_parallel(batch, jobs):
+    """
+    更新したテーブルが重ならないコミットをプロセスプールで並列に処理して、
+    コミットの順番どおりに投稿し、投稿し終えたコミットの cid を返していく
+    失敗したコミットがあればそこで止める(それより後のコミットの投稿は捨てる)
+    """
+    # ワーカーが読み直さず、次のコミットでも親コミットのテーブルとして
+    # 使えるように fork する前に読んでおく
+    next_generation()
+    for cid, updatefiles in batch:
+        prefetch(plan_checks(updatefiles).tables, cid)
+    with fork_pool(min(jobs, len(batch))) as executor:
+        futures = [executor.submit(run_commit, cid, updatefiles)
+                   for cid, updatefiles in batch]
+        for (cid, updatefiles), future in zip(batch, futures):
+            try:
+                posts = future.result()
+            except Exception:
+                logger.error("process_commit failed: %s", cid)
+                raise
+            replay_posts(posts)
+            delivery.seal()
+            yield cid
+
+
+# チェックの登録 (この順番でポストする)
+# triggers: いずれかが更新されたときだけ実行する
+# reads: 必ず読むテーブル
+# reads_if: 更新されたファイル -> そのときだけ読むテーブル
+# データ次第で読むテーブル(消費アイテムなど)は書かずに必要なときに読む
+# names は使う名前の索引 (name_index の種類)
+Check = namedtuple("Check",
+                   ["func", "triggers", "reads", "reads_if", "names"],
+                   defaults=[{}, ()])
+svt_detail_files = [mstSvtLimit_file, mstSvtSkill_file, mstSkill_file,
+                    mstSkillDetail_file, mstSkillLv_file,
+                    mstTreasureDevice_file, mstSvtTreasureDevice_file,
+                    mstTreasureDeviceDetail_file]
+change_reads = {c["file"]: [c["file"]] for c in change_checks}
+change_reads[mstSkillLv_file] += [mstSvtSkill_file, mstSvt_file,
+                                  mstSkill_file]
+check_registry = [
+    Check(check_gacha, [mstGacha_file], [mstGacha_file]),
+    Check(check_svt, [mstSvt_file],
+          [mstSvt_file, mstClass_file] + svt_detail_files),
+    Check(check_strengthen, [mstTreasureDevice_file, mstSkill_file],
+          [mstSvt_file, mstClass_file],
+          {mstTreasureDevice_file: [mstTreasureDevice_file,
+                                    mstSvtTreasureDevice_file,
+                                    mstTreasureDeviceDetail_file],
+           mstSkill_file: [mstSvtSkill_file, mstSkill_file,
+                           mstSkillDetail_file, mstSkillLv_file]}),
+    Check(check_quests, [mstQuest_file], [mstQuest_file],
+          names=item_name_kinds),
+    Check(check_missions, [mstEventMission_file], [mstEventMission_file],
+          names=item_name_kinds),
+    Check(check_shop, [mstShop_file], [mstShop_file], names=item_name_kinds),
+    Check(check_eventReward, [mstEventReward_file],
+          [mstEventReward_file, mstGift_file], names=item_name_kinds),
+    Check(check_box, [mstBoxGacha_file],
+          [mstBoxGacha_file, mstBoxGachaBase_file, mstGift_file],
+          names=item_name_kinds),
+    Check(check_svtfilter, [mstSvtFilter_file],
+          [mstSvtFilter_file, mstSvt_file, mstClass_file]),
+    Check(check_mstEquip, [mstEquip_file],
+          [mstEquip_file, mstEquipSkill_file, mstEquipExp_file,
+           mstSkill_file, mstSkillDetail_file, mstSkillLv_file]),
+    Check(check_costume, [mstSvtCostume_file],
+          [mstSvtCostume_file, mstSvt_file, mstClass_file]),
+    Check(check_changes, [c["file"] for c in change_checks], [],
+          change_reads),
+    Check(check_missionCondition, [mstEventMissionCondition_file],
+          [mstEventMissionCondition_file, mstEventMissionConditionDetail_file,
+           mstEventMission_file], names=item_name_kinds + ("quest",)),
+    Check(check_datavar, [mstver_file], [mstver_file],
+          {mstEvent_file: [mstEvent_file]}),
+]
+Plan = namedtuple("Plan", ["checks", "tables", "skipped", "names"])
+
+
+def plan_checks(updatefiles):
+    """
+    更新ファイルから実行するチェックと読み込むテーブルを決める
+    """
+    updated = set(updatefiles)
+    checks = []
+    tables = []
+    skipped = []
+    kinds = []
+    for check in check_registry:
+        if updated.isdisjoint(check.triggers):
+            skipped.append(check)
+            continue
+        checks.append(check)
+        reads = list(check.reads)
+        for trigger, files in check.reads_if.items():
+            if trigger in updated:
+                reads += files
+        for filename in reads:
+            if filename not in tables:
+                tables.append(filename)
+        for kind in check.names:
+            if kind not in kinds:
+                kinds.append(kind)
+    return Plan(checks, tables, skipped, kinds)
+
+
+def plan_report(plan):
+    """
+    実行計画の表示用の文字列
+    """
+    lines = ["run: " + ", ".join(c.func.__name__ for c in plan.checks),
+             "skip: " + ", ".join(c.func.__name__ for c in plan.skipped),
+             "load {} tables:".format(len(plan.tables))]
+    lines += ["  " + t for t in plan.tables]
+    if len(plan.names) > 0:
+        lines.append("names: " + ", ".join(plan.names))
+    return "\n".join(lines)
+
+
+def prefetch(tables, cid):
+    """
+    テーブルをまとめて読み込む(パース済みのものは読まない)
+    json のパースは GIL を持ったままなのでスレッドにしても速くならず、
+    TableCache と table_memo も共有しているので1つずつ読む
+    """
+    for filename in tables:
+        try:
+            load_file(filename, cid)
+        except Exception as e:
+            # エラーはチェックの中で改めて出す
+            logger.warning("prefetch %s: %s", filename, e)
+
+
+def process_commit(cid, updatefiles, jobs=1):
+    """
+    1コミット分の更新をチェックしてポストする
+    jobs が2以上ならチェックを並列に実行する
+    """
+    global master
+    global mstSvt
+    global id2class
+    next_generation()
+    master = MasterData(load_file, cid)
+    # 前のコミットのものを使わないように、読まないコミットでも空にする
+    mstSvt = []
+    id2class = {}
+
+    plan = plan_checks(updatefiles)
+    logger.info("plan for %s\n%s", cid, plan_report(plan))
+    prefetch(plan.tables, cid)
+    if mstSvt_file in plan.tables:
+        mstSvt = load_file(mstSvt_file, cid)
+    if mstClass_file in plan.tables:
+        mstClass = load_file(mstClass_file, cid)
+        id2class = {c["id"]: c["name"] for c in mstClass}
+    # 名前の索引は変わったテーブルの差分だけ反映する
+    # (並列実行時はワーカーが fork する前に済ませておく)
+    if len(plan.names) > 0:
+        name_index.update(cid, plan.names)
+
+    funcs = [c.func for c in plan.checks]
+    if jobs > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        logger.warning("parallel mode is not supported on this platform")
+        jobs = 1
+    if jobs > 1:
+        run_parallel(funcs, updatefiles, cid, jobs)
+    else:
         for func in funcs:
-            post(func, updatefiles, cid=args.cid)
+            post(func, updatefiles, cid=cid)
+    # このコミットの投稿はまとめ終わったので送り始める
+    delivery.seal()
+
 
+def run_updates(args, commits=True, news=True):
+    """
+    1回分のチェック
+    commits なら未処理のコミット(または args.cid)を、
+    news なら不具合情報をチェックする
+    """
+    global postCount
+    # 常駐時は前回までの分を数えない
+    messages = discord.messages if runtime.imported("delivery") else 0
+    # cid 指定のときは処理したことを記録しない
+    track = commits and args.cid == "HEAD"
+    if not commits:
+        cids = []
+    elif args.cid != "HEAD":
+        cids = [args.cid]
+    else:
+        cids = check_update()
+    if len(cids) > 1:
+        logger.info("catch up %d commits", len(cids))
+    parallel = args.jobs > 1 \
+        and "fork" in multiprocessing.get_all_start_methods()
+    for batch in commit_batches(cids, diff_commits(cids)):
+        if parallel and len(batch) > 1:
+            logger.info("process %d commits in parallel", len(batch))
+            for cid in run_commits_parallel(batch, args.jobs):
+                if track:
+                    save_sha(cid)
+            continue
+        for cid, updatefiles in batch:
+            logger.debug("cid: %s", cid)
+            process_commit(cid, updatefiles, jobs=args.jobs)
+            if track:
+                save_sha(cid)
+
+    # 投稿はまとめて送るので、公開が必要なのは実際のメッセージ数
+    postCount = 0
+    if runtime.imported("delivery"):
+        postCount = discord.messages - messages
     if postCount > 10:
         description = "bot が自動公開するのは10件のみです\n" \
                         + str(postCount - 10) + "件は手動で公開してください"
@@ -1745,9 +2311,70 @@ def main(args):
                                     "description": description,
                                     "color": 15158332}])
 
-    # この機能だけは cid 指定の対象外
-    postCount += trouble.getTrouble()
-    postCount += info_trouble.makeDiffStr()
+    if news:
+        # この機能だけは cid 指定の対象外
+        trouble.getTrouble()
+        # データ更新直後の短い間隔のポーリングはバックグラウンドのプロセスが行う
+        info_trouble.poll_if_due()
+    # ロックを外す前に投稿を送り切る
+    if runtime.imported("delivery"):
+        delivery.flush()
+
+
+@lock_or_through
+def main(args):
+    if args.plan:
+        updatefiles = diff_commits([args.cid])[0]
+        print(plan_report(plan_checks(updatefiles)))
+        return
+    run_updates(args)
+
+
+def daemon(args):
+    """
+    常駐して daemon_interval 秒ごとに git ls-remote でリモートを確認し、
+    前回チェックしたコミットから進んでいたときだけ pull して処理する
+    パース済みのテーブルはメモリに残るので次のコミットでは読み直さない
+    ロックは1回ごとに取り、cron からの実行などと重なったらその回は飛ばす
+    失敗した回は処理し終えたコミットの次から次の回にやり直す
+    (エラーの通知は成功するまで1回だけ)
+    """
+    logger.info("daemon started: interval %d s", daemon_interval)
+    next_news = 0.0
+    failing = False
+    while True:
+        started = time.monotonic()
+        news = started >= next_news
+        try:
+            moved = remote_sha() != load_sha()
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.warning("ls-remote failed: %s", e)
+            moved = False
+        if moved or news:
+            try:
+                lock = lockfile.LockFile(str(lock_f))
+            except LockError:
+                logger.info("locked, skip this cycle")
+                lock = None
+            if lock is not None:
+                try:
+                    run_updates(args, commits=moved, news=news)
+                    if news:
+                        next_news = started + news_interval
+                    failing = False
+                except Exception as e:
+                    logger.exception(e)
+                    if not failing:
+                        discord_error.post(
+                            username="FGO アップデート",
+                            embeds=[{"title": "run_updatesError",
+                                     "description": "Check server log",
+                                     "color": 15158332}])
+                        delivery.flush()
+                    failing = True
+                finally:
+                    lock.close()
+        time.sleep(max(0.0, daemon_interval - (time.monotonic() - started)))
 
 
 if __name__ == '__main__':
@@ -1760,8 +2387,18 @@ if __name__ == '__main__':
                         default='HEAD', help='COMMIT IDを指定')
     parser.add_argument('-l', '--loglevel',
                         choices=('debug', 'info'), default='info')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='チェックを並列に実行するプロセス数')
+    parser.add_argument('--plan', action='store_true',
+                        help='実行するチェックと読み込むテーブルを表示して終了')
+    parser.add_argument('--daemon', action='store_true',
+                        help='常駐してリモートの更新を待つ')
+    parser.add_argument('--setup-repo', action='store_true',
+                        help='fgodata を部分クローン・sparse-checkout にして終了')
 
     args = parser.parse_args()    # 引数を解析
+    if args.daemon and (args.cid != 'HEAD' or args.plan):
+        parser.error('--daemon は -c・--plan と同時に指定できません')
     logging.basicConfig(
         level=logging.INFO,
         format='%(name)s <%(filename)s-L%(lineno)s>'
@@ -1769,4 +2406,13 @@ if __name__ == '__main__':
     )
     logger.setLevel(args.loglevel.upper())
 
-    main(args)
+    if args.setup_repo:
+        setup_repo()
+    elif not runtime.has_repo():
+        logger.critical("%s がありません --setup-repo で作成してください",
+                        fgodata_local_repo)
+        sys.exit(1)
+    elif args.daemon:
+        daemon(args)
+    else:
+        main(args)
@@ -0,0 +1,134 @@
+"""
+news.fate-go.jp のページから必要な部分だけを取り出す
+
+BeautifulSoup (html.parser) は純 Python でページ全体の木を作るので遅い
+lxml がインストールされていれば libxml2 でパースして XPath で取り出す
+無ければ従来どおり BeautifulSoup を使う どちらでも同じ結果を返す
+
+不具合情報のページは <dl> が閉じていないので、
+SoupStrainer で一部だけをパースすると閉じていない <dl> が
+ページの残りを取り込んでしまい結果が変わる そのため使わない
+"""
+from importlib.util import find_spec
+import logging
+
+logger = logging.getLogger(__name__)
+
+# パーサーはページが変わっていて使うときに読み込む
+HAS_LXML = find_spec("lxml") is not None
+BACKENDS = ("lxml", "bs4")
+BACKEND = "lxml" if HAS_LXML else "bs4"
+
+# class 属性に指定の class を含む (CSS の .name と同じ)
+HAS_CLASS = 'contains(concat(" ", normalize-space(@class), " "), " {} ")'
+# get_text() と同じく script・style の中の文字列は含めない
+TEXT_NODES = ".//text()[not(ancestor::script) and not(ancestor::style)]"
+PRESERVE_WHITESPACE = "ancestor-or-self::pre or ancestor-or-self::textarea"
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+
+def _text(element):
+    """
+    BeautifulSoup の get_text() と同じ文字列
+    BeautifulSoup は pre・textarea の外の空白だけの文字列を
+    改行を含めば改行1つ、含まなければ空白1つにするので合わせる
+    """
+    strings = []
+    for s in element.xpath(TEXT_NODES):
+        if s.strip(ASCII_SPACES) == "":
+            container = s.getparent()
+            if s.is_tail:
+                container = container.getparent()
+            if not container.xpath(PRESERVE_WHITESPACE):
+                s = "\n" if "\n" in s else " "
+        strings.append(s)
+    return "".join(strings)
+
+
+def _parse_lxml(content):
+    import lxml.html
+    if isinstance(content, str):
+        content = content.encode("UTF-8")
+    return lxml.html.document_fromstring(
+        content, parser=lxml.html.HTMLParser(encoding="UTF-8"))
+
+
+def _news_list_bs4(content):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, "html.parser")
+    news = []
+    for list_new in soup.select("ul.list_news li"):
+        title = list_new.select_one("p.title").get_text()
+        url_a = list_new.select_one("a")
+        news.append((title, url_a.attrs['href']))
+    return news
+
+
+def _news_list_lxml(content):
+    doc = _parse_lxml(content)
+    news = []
+    for li in doc.xpath("//ul[{}]//li".format(HAS_CLASS.format("list_news"))):
+        title = li.xpath(".//p[{}]".format(HAS_CLASS.format("title")))[0]
+        url_a = li.xpath(".//a")[0]
+        news.append((_text(title), url_a.attrib['href']))
+    return news
+
+
+def _accordion_bs4(content):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, "html.parser")
+    titles = [dt.get_text() for dt in soup.select("dl.accordion > dt")]
+    categories = [[p.get_text() for p in dd.select("p")]
+                  for dd in soup.select("dl.accordion > dd")]
+    page_title = soup.title.text if soup.title is not None else None
+    return page_title, titles, categories
+
+
+def _accordion_lxml(content):
+    doc = _parse_lxml(content)
+    dl = "//dl[{}]".format(HAS_CLASS.format("accordion"))
+    titles = [_text(dt) for dt in doc.xpath(dl + "/dt")]
+    categories = [[_text(p) for p in dd.xpath(".//p")]
+                  for dd in doc.xpath(dl + "/dd")]
+    title = doc.xpath("(//title)[1]")
+    page_title = _text(title[0]) if len(title) > 0 else None
+    return page_title, titles, categories
+
+
+def _article_bs4(content):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, "html.parser")
+    return soup.find('title').get_text(), soup.find('main').get_text()
+
+
+def _article_lxml(content):
+    doc = _parse_lxml(content)
+    return _text(doc.xpath("(//title)[1]")[0]), _text(doc.xpath("(//main)[1]")[0])
+
+
+def news_list(content, backend=None):
+    """
+    お知らせ一覧 (ul.list_news li) の [(タイトル, URL), ...]
+    """
+    if (backend or BACKEND) == "lxml":
+        return _news_list_lxml(content)
+    return _news_list_bs4(content)
+
+
+def accordion(content, backend=None):
+    """
+    不具合情報のページの (ページのタイトル, [カテゴリ名, ...], [[項目, ...], ...])
+    カテゴリ名は dl.accordion > dt、項目は dl.accordion > dd の中の p
+    """
+    if (backend or BACKEND) == "lxml":
+        return _accordion_lxml(content)
+    return _accordion_bs4(content)
+
+
+def article(content, backend=None):
+    """
+    記事のページの (title の文字列, main の文字列)
+    """
+    if (backend or BACKEND) == "lxml":
+        return _article_lxml(content)
+    return _article_bs4(content)
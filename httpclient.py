@@ -0,0 +1,230 @@
+"""
+外部への HTTP 通信で共有するクライアント
+
+requests.Session を1つだけ作り、同じホストへの接続を使い回す(keep-alive)
+接続と読み込みにはタイムアウトを設定し、GET は urllib3 の Retry で数回だけ再試行する
+同じホストで失敗が続いたら一定時間はすぐにエラーにする(サーキットブレーカー)
+
+スクレイピングするページは ETag・Last-Modified と本文のハッシュを保存しておき、
+変わっていなければパースせずに済ませる(条件付き GET)
+"""
+import hashlib
+import json
+import logging
+from pathlib import Path
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import atomicfile
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.5
+POOL_MAXSIZE = 10
+# 連続してこの回数失敗したら BREAKER_COOLDOWN 秒はそのホストに接続しない
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 60
+# 期限後の試しの接続の結果が出るまで、他の呼び出しはこの秒数ごとに確認する
+BREAKER_PROBE_WAIT = 1
+USER_AGENT = "fgo_update (+https://github.com/fgosc/fgo_update)"
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    失敗が続いているホストへの接続を止めている
+    retry_after は接続を再開するまでの秒数
+    """
+    def __init__(self, host, retry_after):
+        super().__init__("circuit open: " + host)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    ホストごとの連続失敗回数と、接続を止めている期限
+    期限を過ぎたホストは試しの接続中(_probing)にして、
+    結果が出るまで他の呼び出しは止めたままにする
+    """
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN,
+                 probe_wait=BREAKER_PROBE_WAIT):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.probe_wait = probe_wait
+        self._failures = {}
+        self._opened_until = {}
+        self._probing = set()
+        self._lock = threading.Lock()
+
+    def check(self, host):
+        """
+        止めている間は CircuitOpenError
+        期限を過ぎたら1回だけ試させる
+        (success・failure・cancel が呼ばれるまで他は CircuitOpenError)
+        """
+        with self._lock:
+            until = self._opened_until.get(host)
+            if until is None:
+                return
+            now = time.monotonic()
+            if now < until:
+                raise CircuitOpenError(host, until - now)
+            if host in self._probing:
+                raise CircuitOpenError(host, self.probe_wait)
+            self._probing.add(host)
+            self._failures[host] = self.threshold - 1
+
+    def success(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_until.pop(host, None)
+            self._probing.discard(host)
+
+    def cancel(self, host):
+        """
+        通信以外の理由で送れなかったときに試しの接続をやめる
+        """
+        with self._lock:
+            self._probing.discard(host)
+
+    def failure(self, host):
+        with self._lock:
+            self._probing.discard(host)
+            n = self._failures.get(host, 0) + 1
+            self._failures[host] = n
+            if n >= self.threshold:
+                logger.warning("open circuit for %s (%d failures)", host, n)
+                self._opened_until[host] = time.monotonic() + self.cooldown
+
+
+def make_session():
+    retry = Retry(total=RETRY_TOTAL, backoff_factor=RETRY_BACKOFF,
+                  status_forcelist=(500, 502, 503, 504),
+                  allowed_methods=frozenset(["GET", "HEAD"]),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=POOL_MAXSIZE)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+session = make_session()
+breaker = CircuitBreaker()
+
+
+def request(method, url, **kwargs):
+    """
+    共有のセッションで送る
+    タイムアウトを指定しなければ (CONNECT_TIMEOUT, READ_TIMEOUT)
+    """
+    host = urlsplit(url).netloc
+    breaker.check(host)
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    try:
+        r = session.request(method, url, **kwargs)
+    except requests.RequestException:
+        breaker.failure(host)
+        raise
+    except BaseException:
+        breaker.cancel(host)
+        raise
+    if r.status_code >= 500:
+        breaker.failure(host)
+    else:
+        breaker.success(host)
+    return r
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, data=None, **kwargs):
+    return request("POST", url, data=data, **kwargs)
+
+
+def fetch(url, **kwargs):
+    """
+    GET して応答を返す 通信できなければログを出して None
+    """
+    try:
+        return get(url, **kwargs)
+    except requests.RequestException as e:
+        logger.error("GET %s: %s", url, e)
+        return None
+
+
+class Validators:
+    """
+    条件付き GET のための URL ごとの ETag・Last-Modified・本文のハッシュ
+    JSON ファイルに保存する
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        try:
+            with open(self.path, encoding="UTF-8") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError) as e:
+            logger.warning("broken validators %s: %s", self.path, e)
+            self.entries = {}
+
+    def headers(self, url):
+        entry = self.entries.get(url, {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def unchanged(self, url, response):
+        """
+        304 か、前回処理した本文と同じなら True
+        """
+        if response.status_code == 304:
+            return True
+        digest = hashlib.sha256(response.content).hexdigest()
+        return self.entries.get(url, {}).get("sha256") == digest
+
+    def update(self, url, response):
+        """
+        処理を終えた応答を記録する
+        """
+        self.entries[url] = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha256": hashlib.sha256(response.content).hexdigest(),
+        }
+
+    def save(self):
+        atomicfile.write_json(self.path, self.entries)
+
+
+def fetch_if_changed(url, validators):
+    """
+    validators を使って条件付き GET する
+    戻り値は (応答, 変更の有無) 通信できないか 200・304 以外なら (None, False)
+    変更があれば、処理を終えてから validators.update() と save() を呼ぶ
+    (途中で失敗したら次回も変更ありになる)
+    """
+    r = fetch(url, headers=validators.headers(url))
+    if r is None:
+        return None, False
+    if r.status_code not in (requests.codes.ok, requests.codes.not_modified):
+        logger.error("GET %s: %s", url, r.status_code)
+        return None, False
+    if validators.unchanged(url, r):
+        logger.debug("not modified: %s", url)
+        return r, False
+    return r, True
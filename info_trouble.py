@@ -1,48 +1,118 @@
 #!/usr/bin/python3
 """
 「現在確認している不具合について」の情報更新をチェックする
+
+データ更新の直後は不具合情報も更新されやすいので短い間隔でポーリングし、
+更新が無ければ間隔を伸ばしていく
+ポーリングは fgoupdate のロックの外(バックグラウンドのプロセス)で行い、
+スケジュールは状態ディレクトリのファイルで共有する
 """
 import argparse
+from hashlib import blake2b
+import json
 import logging
+import os
 from pathlib import Path
+import subprocess
 import time
-import configparser
 import sys
 
-from bs4 import BeautifulSoup
-import requests
-from discordwebhook import Discord
+from zc import lockfile
+from zc.lockfile import LockError
+
+import atomicfile
+import delivery
+import htmlextract
+import httpclient
+import runtime
 
 logger = logging.getLogger(__name__)
-inifile = "fgoupdate.ini"
-basedir = Path(__file__).resolve().parent
+basedir = runtime.basedir
 
+# 以前の形式(ページの HTML をそのまま保存していた) 見つかれば移行する
 backup_f = basedir / "info_trouble.html"
 
+# データ更新後は MIN_INTERVAL 秒から倍々で MAX_INTERVAL 秒まで間隔を伸ばし、
+# BURST_SECONDS 秒たつか更新が見つかったら終える
+MIN_INTERVAL = 60
+MAX_INTERVAL = 600
+BURST_SECONDS = 30 * 60
+# 単体で実行したときは LOOP_SECONDS 秒間隔で最大 LOOP_TIMES 回チェックする
 LOOP_TIMES = 5
 LOOP_SECONDS = 60
 
-# 設定ファイル読み込み
-config = configparser.ConfigParser()
-configfile = basedir / Path(inifile)
-if configfile.exists() is False:
-    print("ファイル {} を作成してください".format(inifile),
-          file=sys.stderr)
-    exit(1)
-config.read(configfile)
-section1 = 'discord'
-webhook_url = config.get(section1, 'webhook')
-discord = Discord(url=webhook_url)
-webhook_error_url = config.get(section1, 'webhook4error', fallback=webhook_url)
-discord_error = Discord(url=webhook_error_url)
+# 設定ファイル読み込み (fgoupdate と共有)
+discord = runtime.discord
+discord_error = runtime.discord_error
+state_dir = runtime.state_dir()
+schedule_f = state_dir / "info_trouble_schedule.json"
+poller_lock_f = state_dir / "info_trouble.lock"
+poller_log_f = state_dir / "info_trouble.log"
+# ページの ETag と本文のハッシュ
+validators_f = state_dir / "info_trouble_http.json"
+# 前回の不具合情報 (カテゴリ名 -> 項目のハッシュ -> 項目の文字列)
+snapshot_f = state_dir / "info_trouble.json"
+
+
+def entry_hash(text: str) -> str:
+    return blake2b(text.encode("UTF-8"), digest_size=8).hexdigest()
 
 
-def troubleDiff(old, new) -> str:
+def make_snapshot(titles, categories) -> dict:
     """
-    消えた情報には価値は無いので新規除法だけ出すように変更
+    htmlextract.accordion の結果から
+    カテゴリ名 -> {項目のハッシュ: 項目の文字列} (ページの順番) を作る
     """
-    new_set = set(new) - set(old)
-    return "\n".join(new_set)
+    snapshot = {}
+    for title, entries in zip(titles, categories):
+        category = snapshot.setdefault(title, {})
+        for entry in entries:
+            category[entry_hash(entry)] = entry
+    return snapshot
+
+
+def load_snapshot():
+    """
+    前回の不具合情報 無ければ None
+    以前の形式の HTML があればそこから作る
+    """
+    try:
+        with open(snapshot_f, encoding="UTF-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.warning("broken snapshot %s: %s", snapshot_f, e)
+        return None
+    if backup_f.exists() is False:
+        return None
+    logger.info("migrate %s to %s", backup_f, snapshot_f)
+    with open(backup_f, "r", encoding="UTF-8") as f:
+        page_title, titles, categories = htmlextract.accordion(f.read())
+    snapshot = make_snapshot(titles, categories)
+    save_snapshot(snapshot)
+    backup_f.unlink()
+    return snapshot
+
+
+def save_snapshot(snapshot: dict):
+    atomicfile.write_json(snapshot_f, snapshot, ensure_ascii=False)
+
+
+def new_entries(snapshot: dict, old_snapshot: dict):
+    """
+    カテゴリごとに前回に無かった項目を [(カテゴリ名, [項目, ...]), ...] で返す
+    消えた情報には価値は無いので新規情報だけにする
+    カテゴリは名前で対応させる 名前が変わったカテゴリは全カテゴリの項目と比べる
+    """
+    everything = set(h for category in old_snapshot.values() for h in category)
+    diffs = []
+    for title, category in snapshot.items():
+        old = old_snapshot.get(title, everything)
+        entries = [entry for h, entry in category.items() if h not in old]
+        if len(entries) > 0:
+            diffs.append((title, entries))
+    return diffs
 
 
 def makeDiffStr() -> int:
@@ -57,83 +127,198 @@ def makeDiffStr() -> int:
     """
     target_url = "https://news.fate-go.jp/info/trouble/"
 
-    # 新規ファイルをチェック
-    r = requests.get(target_url)
-    if r.status_code != requests.codes.ok:
+    # 新規ファイルをチェック 前回から変わっていなければパースしない
+    # (バックグラウンドのポーラーとは別プロセスなので毎回読み直す)
+    validators = httpclient.Validators(validators_f)
+    r, changed = httpclient.fetch_if_changed(target_url, validators)
+    if r is None:
         return False
-    soup_new = BeautifulSoup(r.content, "html.parser")
-
-    new_titles = soup_new.select("dl.accordion > dt")
-    titles = []
-    for new_title in new_titles:
-        titles.append(new_title.get_text())
-
+    if not changed:
+        return 0
     # <dl> タグが閉じてないので <dd>で切り出す
-    new_categories = soup_new.select("dl.accordion > dd")
-    news = []
-    for new_category in new_categories:
-        new = []
-        p_news = new_category.select("p")
-        for p_new in p_news:
-            new.append(p_new.get_text())
-        news.append(new)
-
-    # ローカルファイルをチェック
-    if backup_f.exists() is False:
-        logger.warning("FILE %s don't exists.", backup_f)
-        r = requests.get(target_url)
-        if r.status_code != requests.codes.ok:
-            return False
-        with open(backup_f, "wb") as savefile:
-            savefile.write(r.content)
-        return False
+    page_title, titles, news = htmlextract.accordion(r.content)
+    snapshot = make_snapshot(titles, news)
 
-    with open(backup_f, "r", encoding="UTF-8") as f:
-        soup_old = BeautifulSoup(f, "html.parser")
-    old_categories = soup_old.select("dl.accordion > dd")
-    olds = []
-    for old_category in old_categories:
-        old = []
-        p_olds = old_category.select("p")
-        for p_old in p_olds:
-            old.append(p_old.get_text())
-        olds.append(old)
+    # 前回の情報をチェック
+    old_snapshot = load_snapshot()
+    if old_snapshot is None:
+        logger.warning("FILE %s don't exists.", snapshot_f)
+        save_snapshot(snapshot)
+        validators.update(target_url, r)
+        validators.save()
+        return False
 
     fields = []
-    for i, (old, new) in enumerate(zip(olds, news)):
-        str_diff = troubleDiff(old, new)
-
-        if len(str_diff) > 0:
-            name = titles[i].replace("■", ":bug:") + ":bug:"
-            value = "```" + str_diff + "```"
-            fields.append({"name": name, "value": value})
+    for category, entries in new_entries(snapshot, old_snapshot):
+        name = category.replace("■", ":bug:") + ":bug:"
+        value = "```" + "\n".join(entries) + "```"
+        fields.append({"name": name, "value": value})
     if len(fields) > 0:
-        title = soup_new.title.text.replace("  |  Fate/Grand Order 公式サイト", "")
+        title = page_title.replace("  |  Fate/Grand Order 公式サイト", "")
         icon_url = "https://pbs.twimg.com/profile_images/1034364986041163776/tRqcymzd_400x400.jpg"
-        discord.post(username="FGO アップデート",
-                     embeds=[{
-                              "title": title,
-                              "author": {
-                                         "name": "Fate/Grand Order 公式サイト",
-                                         "icon_url": icon_url
-                                    },
-                              "url": target_url,
-                              "fields": fields,
-                              "color": 5620992}])
-        # ファイルを入れ替え
-        with open(backup_f, "wb") as savefile:
-            savefile.write(r.content)
-        return len(fields)
-    # postCount += 1
-    return 0
+        messages = discord.post(username="FGO アップデート",
+                                embeds=[{
+                                         "title": title,
+                                         "author": {
+                                                    "name": "Fate/Grand Order 公式サイト",
+                                                    "icon_url": icon_url
+                                               },
+                                         "url": target_url,
+                                         "fields": fields,
+                                         "color": 5620992}])
+        # 投稿できなかったら前回の情報のままにして、次回投稿し直す
+        delivery.flush()
+        if not all(m.delivered for m in messages):
+            logger.warning("failed to post %s", target_url)
+            return 0
+        # 前回の情報を入れ替え
+        save_snapshot(snapshot)
+    validators.update(target_url, r)
+    validators.save()
+    return len(fields)
+
+
+def load_schedule() -> dict:
+    """
+    ポーリングのスケジュール
+    {"burst_until": 終了時刻, "interval": 次の間隔(秒), "next_at": 次の時刻}
+    短い間隔のポーリング中でなければ空
+    """
+    try:
+        with open(schedule_f, encoding="UTF-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("broken schedule %s: %s", schedule_f, e)
+        return {}
+
+
+def save_schedule(schedule: dict):
+    atomicfile.write_json(schedule_f, schedule)
+
+
+def in_burst(schedule: dict) -> bool:
+    return schedule.get("burst_until", 0) > time.time()
+
+
+def request_poll():
+    """
+    データ更新があったので、すぐに短い間隔のポーリングを始める
+    ここではスケジュールを書くだけで通信はしない
+    """
+    now = time.time()
+    save_schedule({"burst_until": now + BURST_SECONDS,
+                   "interval": MIN_INTERVAL,
+                   "next_at": now})
+
+
+def poll() -> int:
+    """
+    1回ポーリングしてスケジュールを進める
+    ポーラーのロックを持って呼ぶ
+    """
+    count = makeDiffStr()
+    # ポーリング中に request_poll されていてもよいように読み直す
+    schedule = load_schedule()
+    if count > 0 or not in_burst(schedule):
+        schedule = {}
+    else:
+        interval = schedule.get("interval", MIN_INTERVAL)
+        schedule["next_at"] = time.time() + interval
+        schedule["interval"] = min(interval * 2, MAX_INTERVAL)
+        logger.debug("next poll in %d s", interval)
+    save_schedule(schedule)
+    return count
+
+
+def lock_poller():
+    """
+    ポーラーのロック 他のプロセスがポーリング中なら None
+    """
+    state_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        return lockfile.LockFile(str(poller_lock_f))
+    except LockError:
+        logger.debug("poller is already running")
+        return None
+
+
+def run_loop():
+    """
+    短い間隔のポーリングが終わるまで、時刻が来るたびにポーリングする
+    """
+    lock = lock_poller()
+    if lock is None:
+        return
+    try:
+        while True:
+            schedule = load_schedule()
+            if not in_burst(schedule):
+                if len(schedule) > 0:
+                    save_schedule({})
+                break
+            delay = schedule.get("next_at", 0) - time.time()
+            if delay > 0:
+                # 途中で request_poll されたら早めに気づけるように区切って待つ
+                time.sleep(min(delay, MIN_INTERVAL))
+                continue
+            poll()
+            delivery.flush()
+    finally:
+        lock.close()
+
+
+def start_poller():
+    """
+    run_loop をバックグラウンドのプロセスで動かす
+    既に動いていれば新しいプロセスはロックを取れずにすぐ終わる
+    """
+    state_dir.mkdir(parents=True, exist_ok=True)
+    with open(poller_log_f, "ab") as log:
+        subprocess.Popen([sys.executable, str(Path(__file__).resolve()),
+                          "--loop"],
+                         cwd=basedir, stdin=subprocess.DEVNULL,
+                         stdout=log, stderr=subprocess.STDOUT,
+                         start_new_session=(os.name == "posix"))
+
+
+def poll_if_due() -> int:
+    """
+    cron からの定期実行で呼ぶ
+    短い間隔のポーリング中ならバックグラウンドのプロセスに任せ、
+    そうでなければ1回だけポーリングする
+    """
+    if in_burst(load_schedule()):
+        start_poller()
+        return 0
+    lock = lock_poller()
+    if lock is None:
+        return 0
+    try:
+        return poll()
+    finally:
+        lock.close()
 
 
 def getInfoTrouble():
-    for i in range(LOOP_TIMES):
-        if i > 0:
-            time.sleep(LOOP_SECONDS)
-        if makeDiffStr() > 0:
-            break
+    """
+    単体で実行したときのチェック (最大 LOOP_TIMES 回)
+    バックグラウンドのプロセスがポーリング中なら任せる
+    """
+    lock = lock_poller()
+    if lock is None:
+        return
+    try:
+        for i in range(LOOP_TIMES):
+            if i > 0:
+                time.sleep(LOOP_SECONDS)
+            count = makeDiffStr()
+            delivery.flush()
+            if count > 0:
+                break
+    finally:
+        lock.close()
 
 
 if __name__ == '__main__':
@@ -144,6 +329,9 @@ if __name__ == '__main__':
     # 3. parser.add_argumentで受け取る引数を追加していく
     parser.add_argument('-l', '--loglevel',
                         choices=('debug', 'info'), default='info')
+    parser.add_argument('--loop', action='store_true',
+                        help='スケジュールどおりにポーリングを続ける'
+                             '(fgoupdate から起動される)')
 
     args = parser.parse_args()    # 引数を解析
     logging.basicConfig(
@@ -153,4 +341,7 @@ if __name__ == '__main__':
     )
     logger.setLevel(args.loglevel.upper())
 
-    getInfoTrouble()
+    if args.loop:
+        run_loop()
+    else:
+        getInfoTrouble()
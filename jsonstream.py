@@ -0,0 +1,121 @@
+"""
+巨大な JSON 配列のテーブルを1行ずつ読む
+
+json.load はファイル全体を dict のリストにするので、
+mstQuest のような大きなテーブルではメモリを大きく消費する
+ここでは1行ずつデコードして必要な列だけをタプルにして返す
+ijson がインストールされていればそれを使う
+"""
+import codecs
+import json
+import logging
+from operator import itemgetter
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = " \t\n\r"
+
+
+def _iter_stdlib(fp, chunk_size):
+    """
+    JSONDecoder.raw_decode で配列の要素を1つずつ取り出す
+    バッファにはまだデコードしていない部分しか持たない
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8-sig")()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        data = fp.read(chunk_size)
+        if not data:
+            eof = True
+            buf = buf[pos:] + utf8.decode(b"", final=True)
+        else:
+            buf = buf[pos:] + utf8.decode(data)
+        pos = 0
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    fill()
+    skip_ws()
+    if pos >= len(buf) or buf[pos] != "[":
+        raise ValueError("top level of JSON is not an array")
+    pos += 1
+    skip_ws()
+    if pos < len(buf) and buf[pos] == "]":
+        return
+    while True:
+        try:
+            row, end = decoder.raw_decode(buf, pos)
+            # 数値などはチャンクの境目で途切れていても成功するので
+            # 後ろに区切り文字が来ていることを確認する
+            if end >= len(buf) and not eof:
+                raise json.JSONDecodeError("need more data", buf, end)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        pos = end
+        yield row
+        skip_ws()
+        if pos >= len(buf):
+            raise ValueError("unexpected end of JSON array")
+        if buf[pos] == "]":
+            return
+        if buf[pos] != ",":
+            raise ValueError("unexpected character {!r}".format(buf[pos]))
+        pos += 1
+        skip_ws()
+
+
+def iter_objects(fp, chunk_size=CHUNK_SIZE):
+    """
+    バイナリのファイルオブジェクト(read(n) があればよい)から
+    トップレベルの配列の要素を1つずつ返す
+    """
+    if ijson is not None:
+        return ijson.items(fp, "item", use_float=True)
+    return _iter_stdlib(fp, chunk_size)
+
+
+def iter_rows(fp, fields, predicate=None, chunk_size=CHUNK_SIZE):
+    """
+    fields の列の値のタプルを1行ずつ返す
+    predicate があれば predicate(行) が真の行だけを返す
+    """
+    getter = itemgetter(*fields)
+    single = len(fields) == 1
+    for row in iter_objects(fp, chunk_size):
+        if predicate is not None and not predicate(row):
+            continue
+        if single:
+            yield (getter(row),)
+        else:
+            yield getter(row)
+
+
+def project_rows(rows, fields, predicate=None):
+    """
+    パース済みのテーブルから iter_rows と同じ形のリストを作る
+    """
+    getter = itemgetter(*fields)
+    single = len(fields) == 1
+    return [(getter(row),) if single else getter(row) for row in rows
+            if predicate is None or predicate(row)]
@@ -0,0 +1,141 @@
+"""
+id から名前を引く索引 (アイテム・サーヴァント・コマンドコード・クエスト)
+
+各チェックで mstItem・mstSvt・mstCommandCode を読んで作り直していた
+id -> 名前 の dict を1つにまとめる
+
+テーブルごとに id -> 名前 を持ち、blob SHA と一緒に状態ディレクトリに保存する
+- blob が同じなら読み込まない
+- 保存したものが親コミットの blob なら差分(追加・変更・削除)だけを反映する
+- それ以外は id と name の列だけを読んで作り直す
+"""
+from collections.abc import Mapping
+import json
+import logging
+from pathlib import Path
+import threading
+
+import atomicfile
+
+logger = logging.getLogger(__name__)
+
+# 保存形式を変えたら上げる
+FORMAT_VERSION = 1
+
+
+class Names(Mapping):
+    """
+    複数のテーブルの id -> 名前 を重ねた読み取り専用の dict
+    同じ id があれば後ろのテーブルの名前を使う
+    """
+    def __init__(self, layers):
+        self._layers = layers[::-1]
+
+    def __getitem__(self, key):
+        for layer in self._layers:
+            if key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return any(key in layer for layer in self._layers)
+
+    def __iter__(self):
+        seen = set()
+        for layer in self._layers:
+            for key in layer:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class NameIndex:
+    """
+    テーブルごとの id -> 名前 と、その blob SHA
+
+    sources は 種類 -> テーブルのファイル名
+    blob_sha・diff_table・load_projection は fgoupdate の同名の関数
+    """
+    def __init__(self, directory, sources, blob_sha, diff_table,
+                 load_projection):
+        self.directory = Path(directory)
+        self.sources = sources
+        self._blob_sha = blob_sha
+        self._diff_table = diff_table
+        self._load_projection = load_projection
+        # 種類 -> (blob SHA, id -> 名前)
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def _path(self, kind):
+        return self.directory / "{}.json".format(kind)
+
+    def _load(self, kind):
+        """
+        保存した (blob SHA, id -> 名前) 無ければ (None, None)
+        """
+        path = self._path(kind)
+        try:
+            with open(path, encoding="UTF-8") as f:
+                data = json.load(f)
+            if data.get("version") != FORMAT_VERSION:
+                return None, None
+            return data["sha"], {int(k): v for k, v in data["names"].items()}
+        except FileNotFoundError:
+            return None, None
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            logger.warning("broken name index %s: %s", path, e)
+            return None, None
+
+    def _save(self, kind, sha, names):
+        atomicfile.write_json(self._path(kind),
+                              {"version": FORMAT_VERSION, "sha": sha,
+                               "names": names}, ensure_ascii=False)
+
+    def _update(self, kind, cid):
+        filename = self.sources[kind]
+        sha = self._blob_sha(filename, cid)
+        prev = self._tables.get(kind)
+        if prev is None:
+            prev = self._load(kind)
+        prev_sha, names = prev
+        if prev_sha == sha:
+            self._tables[kind] = prev
+            return
+        if prev_sha is not None \
+           and prev_sha == self._blob_sha(filename, cid + "^"):
+            # 差分は各チェックと共有している
+            diff = self._diff_table(filename, cid)
+            names = dict(names)
+            for k in diff.removed:
+                names.pop(k, None)
+            for k, row in diff.added.items():
+                names[k] = row["name"]
+            for k, row in diff.changed.items():
+                names[k] = row["name"]
+            logger.debug("update names %s: +%d ~%d -%d", kind,
+                         len(diff.added), len(diff.changed),
+                         len(diff.removed))
+        else:
+            logger.debug("build names %s", kind)
+            names = dict(self._load_projection(filename, cid, ["id", "name"]))
+        self._tables[kind] = (sha, names)
+        self._save(kind, sha, names)
+
+    def update(self, cid, kinds=None):
+        """
+        kinds の索引を cid の時点に合わせる (省略時は全て)
+        """
+        with self._lock:
+            for kind in kinds or self.sources:
+                self._update(kind, cid)
+
+    def names(self, cid, *kinds):
+        """
+        kinds の順に重ねた id -> 名前 (同じ id は後ろを優先)
+        """
+        self.update(cid, kinds)
+        return Names([self._tables[kind][1] for kind in kinds])
@@ -0,0 +1,126 @@
+"""
+fgoupdate・trouble・info_trouble で共有する設定と外部のリソース
+
+設定ファイルは最初に使うときに1回だけ読む
+Discord の webhook と fgodata のリポジトリは最初に使うときに作るので、
+更新が無い回は GitPython を読み込まずに済む
+"""
+import configparser
+import importlib
+import logging
+from pathlib import Path
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+inifile = "fgoupdate.ini"
+basedir = Path(__file__).resolve().parent
+
+_config = None
+
+
+def config():
+    """
+    設定ファイル 無ければ終了する
+    """
+    global _config
+    if _config is None:
+        configfile = basedir / Path(inifile)
+        if configfile.exists() is False:
+            print("ファイル {} を作成してください".format(inifile),
+                  file=sys.stderr)
+            sys.exit(1)
+        parser = configparser.ConfigParser()
+        parser.read(configfile)
+        _config = parser
+    return _config
+
+
+class Lazy:
+    """
+    最初に属性を参照したときに factory() で作ったオブジェクトの代わりになる
+    """
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_target", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _get(self):
+        target = self._target
+        if target is not None:
+            return target
+        with self._lock:
+            if self._target is None:
+                object.__setattr__(self, "_target", self._factory())
+            return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get(), name, value)
+
+
+def lazy_import(name):
+    """
+    最初に属性を参照したときに import するモジュール
+    """
+    return Lazy(lambda: importlib.import_module(name))
+
+
+def imported(name):
+    """
+    モジュールが既に読み込まれているか
+    """
+    return name in sys.modules
+
+
+def state_dir():
+    """
+    処理結果を保存するディレクトリ
+    """
+    return basedir / config().get('state', 'directory', fallback="state")
+
+
+def webhook_url():
+    return config().get('discord', 'webhook')
+
+
+def webhook_error_url():
+    return config().get('discord', 'webhook4error', fallback=webhook_url())
+
+
+def _webhook(url):
+    import delivery
+    return delivery.Webhook(url=url)
+
+
+discord = Lazy(lambda: _webhook(webhook_url()))
+discord_error = Lazy(lambda: _webhook(webhook_error_url()))
+
+
+def fgodata_url():
+    return config().get('fgodata', 'repository')
+
+
+def fgodata_local_repo():
+    """
+    fgodata のローカルリポジトリ (fgo_update と同じ階層)
+    """
+    fgodata = fgodata_url().replace("https://github.com/", "") \
+                           .replace(".git", "")
+    return basedir.parent / fgodata.split("/")[-1]
+
+
+def has_repo():
+    return (fgodata_local_repo() / ".git").exists()
+
+
+def _repo():
+    import git
+    return git.Repo(fgodata_local_repo())
+
+
+repo = Lazy(_repo)
+origin = Lazy(lambda: repo.remotes.origin)
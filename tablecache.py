@@ -0,0 +1,121 @@
+"""
+パース済みテーブルのディスクキャッシュ
+
+git の blob SHA をキーにして pickle + zlib で保存する
+同じ内容の blob は何度コミットされても同じキーになるので、
+一度でも読んだテーブルは HEAD でも親コミットでもキャッシュから読める
+容量が上限を超えたら最終アクセスが古いものから削除する(LRU)
+"""
+import logging
+import os
+import pickle
+import zlib
+from pathlib import Path
+
+import atomicfile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZE_LIMIT = 512 * 1024 * 1024
+# 上限を超えたときはここまで減らす(削除を毎回走らせないため)
+EVICT_RATIO = 0.8
+COMPRESS_LEVEL = 1
+
+
+class TableCache:
+    """
+    blob SHA -> パース済みテーブル のキャッシュ
+
+    最終アクセス時刻はファイルの mtime で管理する
+    (noatime でマウントされていても LRU が機能するように)
+    """
+    def __init__(self, cache_dir, size_limit=DEFAULT_SIZE_LIMIT):
+        self.cache_dir = Path(cache_dir)
+        self.size_limit = size_limit
+        self._total = None
+
+    def _path(self, sha):
+        return self.cache_dir / sha[:2] / (sha + ".pz")
+
+    def get(self, sha):
+        """
+        キャッシュがあればパース済みテーブルを、無ければ None を返す
+        """
+        path = self._path(sha)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            obj = pickle.loads(zlib.decompress(data))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # 壊れたキャッシュは捨てて読み直させる
+            logger.warning("broken cache %s: %s", path, e)
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        logger.debug("cache hit: %s", sha)
+        return obj
+
+    def put(self, sha, obj):
+        """
+        パース済みテーブルを保存する
+        """
+        if self.size_limit <= 0:
+            return
+        path = self._path(sha)
+        data = zlib.compress(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL),
+                             COMPRESS_LEVEL)
+        if len(data) > self.size_limit:
+            logger.debug("too large to cache: %s", sha)
+            return
+        # 同じ SHA を書き直すときは前のファイルの分を数え直す
+        try:
+            old_size = path.stat().st_size
+        except OSError:
+            old_size = 0
+        atomicfile.write_bytes(path, data)
+        if self._total is not None:
+            self._total += len(data) - old_size
+        self._evict()
+
+    def _remove(self, path):
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except OSError:
+            return
+        if self._total is not None:
+            self._total -= size
+
+    def _entries(self):
+        entries = []
+        for path in self.cache_dir.glob("*/*.pz"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self):
+        if self._total is None:
+            self._total = sum(e[1] for e in self._entries())
+        if self._total <= self.size_limit:
+            return
+        entries = sorted(self._entries())
+        total = sum(e[1] for e in entries)
+        target = self.size_limit * EVICT_RATIO
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            logger.debug("evict: %s", path.name)
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+        self._total = total
@@ -0,0 +1,295 @@
+"""
+テーブルの差分を取る
+
+各チェックで個別に行っていた
+「現在と親コミットのキー集合を作って引き算し、新しいキーの行を探し直す」
+処理を1回の走査で行う
+"""
+import logging
+import os
+import struct
+import zlib
+from array import array
+from collections import namedtuple
+from hashlib import blake2b
+from operator import itemgetter
+from pathlib import Path
+
+import atomicfile
+
+logger = logging.getLogger(__name__)
+
+# added/removed/changed はいずれも キー -> 行 の dict (テーブルの並び順)
+# 同じキーの行が複数あるときは先頭の行を値にする
+# changed は両方にあって内容が異なるキー(値は現在の行)
+TableDiff = namedtuple("TableDiff", ["added", "removed", "changed"])
+
+EMPTY = TableDiff({}, {}, {})
+
+# 指紋の作り方を変えたら番号を上げる(古いスナップショットは読み捨てる)
+SNAPSHOT_MAGIC = b"FGSS2"
+
+
+def key_func(key):
+    """
+    キーの指定(列名 or 関数)を関数にする
+    """
+    if callable(key):
+        return key
+    return itemgetter(key)
+
+
+def group_rows(rows, key="id", row_filter=None):
+    """
+    キー -> 行のリスト の dict を作る
+    """
+    get_key = key_func(key)
+    groups = {}
+    for row in rows:
+        if row_filter is not None and not row_filter(row):
+            continue
+        k = get_key(row)
+        group = groups.get(k)
+        if group is None:
+            groups[k] = [row]
+        else:
+            group.append(row)
+    return groups
+
+
+def diff_groups(groups, prev_groups):
+    """
+    group_rows の結果同士の差分を取る
+    """
+    added = {}
+    changed = {}
+    for k, group in groups.items():
+        prev_group = prev_groups.get(k)
+        if prev_group is None:
+            added[k] = group[0]
+        elif prev_group != group:
+            changed[k] = group[0]
+    removed = {k: group[0] for k, group in prev_groups.items()
+               if k not in groups}
+    return TableDiff(added, removed, changed)
+
+
+def diff_rows(rows, prev_rows, key="id", row_filter=None):
+    """
+    rows(現在) と prev_rows(親コミット) の差分を取る
+    row_filter は両方に適用する
+    """
+    return diff_groups(group_rows(rows, key, row_filter),
+                       group_rows(prev_rows, key, row_filter))
+
+
+class RowHasher:
+    """
+    行の内容から64bitの指紋を作る
+    列名を整列した順の値のタプルをハッシュするので、
+    列の並び順によらず、プロセスをまたいでも同じ値になる
+
+    テーブルの行はほとんど同じ列構成なので、
+    直前の行と列が同じなら整列済みの getter と列名のハッシュを使い回す
+    """
+    def __init__(self):
+        self._columns = None
+        self._getter = None
+        self._base = None
+
+    def __call__(self, row):
+        columns = tuple(row)
+        if columns != self._columns:
+            names = sorted(columns)
+            self._columns = columns
+            self._getter = itemgetter(*names) if len(names) > 0 \
+                else (lambda r: ())
+            self._base = blake2b(repr(names).encode(), digest_size=8)
+        h = self._base.copy()
+        h.update(repr(self._getter(row)).encode())
+        return int.from_bytes(h.digest(), "little")
+
+
+def fingerprint(row):
+    """
+    1行の指紋
+    """
+    return RowHasher()(row)
+
+
+def group_fingerprints(groups):
+    """
+    group_rows の結果から キー -> 指紋 の dict を作る
+    同じキーの行が複数あるときは各行の指紋をまとめてハッシュする
+    """
+    row_hash = RowHasher()
+    hashes = {}
+    for k, group in groups.items():
+        if len(group) == 1:
+            hashes[k] = row_hash(group[0])
+            continue
+        h = blake2b(digest_size=8)
+        for row in group:
+            h.update(row_hash(row).to_bytes(8, "little"))
+        hashes[k] = int.from_bytes(h.digest(), "little")
+    return hashes
+
+
+def diff_snapshot(rows, prev_hashes, load_prev_rows,
+                  key="id", row_filter=None):
+    """
+    親コミットのスナップショット(キー -> 指紋)を使って差分を取る
+    新規追加だけなら親コミットのテーブルは読まない
+    指紋が変わった行に row_filter がかかる場合と、削除された行がある場合は
+    load_prev_rows() で親コミットのテーブルを読んで diff_rows と同じ結果を返す
+
+    戻り値は (TableDiff, 現在のテーブルのキー -> 指紋)
+    """
+    groups = group_rows(rows, key)
+    hashes = group_fingerprints(groups)
+    removed = [k for k in prev_hashes if k not in hashes]
+    differ = [k for k, h in hashes.items()
+              if k in prev_hashes and prev_hashes[k] != h]
+    if len(removed) > 0 or (row_filter is not None and len(differ) > 0):
+        logger.debug("load prev rows: removed %d, changed %d",
+                     len(removed), len(differ))
+        diff = diff_rows(rows, load_prev_rows(), key, row_filter)
+        return diff, hashes
+
+    added = {}
+    changed = {}
+    for k, group in groups.items():
+        if row_filter is not None:
+            group = [row for row in group if row_filter(row)]
+            if len(group) == 0:
+                continue
+        if k not in prev_hashes:
+            added[k] = group[0]
+        elif prev_hashes[k] != hashes[k]:
+            changed[k] = group[0]
+    return TableDiff(added, {}, changed), hashes
+
+
+def changed_fields(row, prev_row, fields):
+    """
+    fields のうち値が変わった列の [(列名, 変更前, 変更後), ...]
+    """
+    return [(f, prev_row.get(f), row.get(f)) for f in fields
+            if prev_row.get(f) != row.get(f)]
+
+
+def field_changes(rows, prev_rows, keys, fields, key="id", subkey=None):
+    """
+    keys(内容が変わったキー)の行について fields の列の変更を調べる
+    指紋が同じ行は keys に入らないので、列ごとの比較は変わった行だけで済む
+    同じキーの行が複数あるときは subkey の値で、
+    subkey が無ければ並び順で親コミットの行と対応させる
+
+    戻り値は [(現在の行, 親コミットの行, changed_fields の結果), ...]
+    (テーブルの並び順) fields に変更が無い行は含まない
+    """
+    keys = set(keys)
+    if len(keys) == 0:
+        return []
+    get_key = key_func(key)
+
+    def in_keys(row):
+        return get_key(row) in keys
+
+    groups = group_rows(rows, key, in_keys)
+    prev_groups = group_rows(prev_rows, key, in_keys)
+    results = []
+    for k, group in groups.items():
+        prev_group = prev_groups.get(k, [])
+        if subkey is None:
+            pairs = zip(group, prev_group)
+        else:
+            get_subkey = key_func(subkey)
+            prev_by_subkey = {}
+            for prev_row in prev_group:
+                prev_by_subkey.setdefault(get_subkey(prev_row), prev_row)
+            pairs = [(row, prev_by_subkey[get_subkey(row)]) for row in group
+                     if get_subkey(row) in prev_by_subkey]
+        for row, prev_row in pairs:
+            changes = changed_fields(row, prev_row, fields)
+            if len(changes) > 0:
+                results.append((row, prev_row, changes))
+    return results
+
+
+class SnapshotStore:
+    """
+    テーブルのキー集合と行の指紋を blob SHA ごとに保存する
+
+    キーは整数のみ対応(ソート済みの整数配列と指紋の配列で保存する)
+    ファイル数が上限を超えたら最終アクセスが古いものから削除する
+    """
+    def __init__(self, directory, max_files=256):
+        self.directory = Path(directory)
+        self.max_files = max_files
+
+    def _path(self, sha, key):
+        return self.directory / "{}.{}.snap".format(sha, key)
+
+    def load(self, sha, key):
+        """
+        キー -> 指紋 の dict を返す 無ければ None
+        """
+        if not isinstance(key, str):
+            return None
+        path = self._path(sha, key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            if data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                if data[:len(SNAPSHOT_MAGIC) - 1] == SNAPSHOT_MAGIC[:-1]:
+                    # 指紋の作り方が違う古い形式
+                    logger.debug("old snapshot format: %s", path.name)
+                    path.unlink(missing_ok=True)
+                    return None
+                raise ValueError("bad magic")
+            data = zlib.decompress(data[len(SNAPSHOT_MAGIC):])
+            count = struct.unpack_from("<Q", data)[0]
+            keys = array("q")
+            keys.frombytes(data[8:8 + count * 8])
+            hashes = array("Q")
+            hashes.frombytes(data[8 + count * 8:8 + count * 16])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("broken snapshot %s: %s", path, e)
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return dict(zip(keys, hashes))
+
+    def save(self, sha, key, hashes):
+        """
+        キー -> 指紋 の dict を保存する
+        """
+        if not isinstance(key, str):
+            return
+        path = self._path(sha, key)
+        if path.exists():
+            return
+        if not all(isinstance(k, int) for k in hashes):
+            logger.debug("skip snapshot of non-integer keys: %s", key)
+            return
+        keys = sorted(hashes)
+        data = struct.pack("<Q", len(keys)) \
+            + array("q", keys).tobytes() \
+            + array("Q", [hashes[k] for k in keys]).tobytes()
+        atomicfile.write_bytes(path, SNAPSHOT_MAGIC + zlib.compress(data))
+        self._prune()
+
+    def _prune(self):
+        files = list(self.directory.glob("*.snap"))
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=lambda p: p.stat().st_mtime)
+        for path in files[:len(files) - self.max_files]:
+            logger.debug("remove snapshot: %s", path.name)
+            path.unlink(missing_ok=True)
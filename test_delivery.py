@@ -0,0 +1,110 @@
+import json
+
+import delivery
+
+URL = "https://discord.test/api/webhooks/1/x"
+
+
+class Response:
+    def __init__(self, status_code=204):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {}
+        self.text = ""
+
+
+class Session:
+    """
+    送った内容を記録する httpclient の代わり
+    """
+    def __init__(self, status_code=204):
+        self.status_code = status_code
+        self.posts = []
+
+    def post(self, url, data=None, headers=None, files=None):
+        if files is not None:
+            payload = json.loads(data["payload_json"])
+        else:
+            payload = json.loads(data)
+        self.posts.append((payload, files))
+        return Response(self.status_code)
+
+
+def webhook(status_code=204):
+    session = Session(status_code)
+    queue = delivery.DeliveryQueue(session=session)
+    return delivery.Webhook(url=URL, delivery_queue=queue), session
+
+
+def embed(chars=0, title="t"):
+    return {"title": title, "description": "x" * (chars - len(title))}
+
+
+def test_split_at_max_embeds():
+    hook, session = webhook()
+    for i in range(delivery.MAX_EMBEDS + 1):
+        hook.post(username="FGO アップデート", embeds=[embed(10)])
+    hook.queue.flush()
+    assert [len(p["embeds"]) for p, f in session.posts] \
+        == [delivery.MAX_EMBEDS, 1]
+    assert hook.messages == 2
+
+
+def test_split_at_max_embed_chars():
+    hook, session = webhook()
+    hook.post(username="FGO アップデート",
+              embeds=[embed(3000), embed(delivery.MAX_EMBED_CHARS - 3100)])
+    # ちょうど上限までは同じメッセージに入る
+    hook.post(username="FGO アップデート", embeds=[embed(100)])
+    hook.post(username="FGO アップデート", embeds=[embed(1)])
+    hook.queue.flush()
+    assert [sum(delivery.embed_length(e) for e in p["embeds"])
+            for p, f in session.posts] == [delivery.MAX_EMBED_CHARS, 1]
+
+
+def test_split_at_max_files():
+    hook, session = webhook()
+    for i in range(delivery.MAX_FILES + 1):
+        hook.post(username="FGO アップデート", embeds=[embed(10)],
+                  file={"file1": delivery.text_file("{}.txt".format(i),
+                                                    "text")})
+    hook.queue.flush()
+    assert [len(f) for p, f in session.posts] == [delivery.MAX_FILES, 1]
+    # 名前は付け直し、ファイル名は元のまま
+    assert session.posts[0][1]["file10"] == ("9.txt", b"text")
+
+
+def test_seal_and_different_payload_are_not_merged():
+    hook, session = webhook()
+    hook.post(username="FGO アップデート", embeds=[embed(10)])
+    hook.post(username="other", embeds=[embed(10)])
+    hook.queue.seal()
+    hook.post(username="other", embeds=[embed(10)])
+    hook.post(content="text")
+    hook.post(content="text")
+    hook.queue.flush()
+    assert [p.get("username") for p, f in session.posts] \
+        == ["FGO アップデート", "other", "other", None, None]
+
+
+def test_split_embed_fields():
+    fields = [{"name": str(i), "value": "v"}
+              for i in range(delivery.MAX_FIELDS + 1)]
+    embeds = delivery.split_embed({"title": "t", "fields": fields,
+                                   "color": 1})
+    assert [len(e["fields"]) for e in embeds] == [delivery.MAX_FIELDS, 1]
+    assert embeds[1] == {"fields": fields[-1:], "color": 1}
+
+
+def test_delivered():
+    hook, session = webhook()
+    messages = hook.post(username="FGO アップデート", embeds=[embed(10)])
+    hook.queue.flush()
+    assert all(m.delivered for m in messages)
+
+    hook, session = webhook(400)
+    messages = hook.post(username="FGO アップデート", embeds=[embed(10)])
+    hook.queue.flush()
+    assert [m.delivered for m in messages] == [False]
+    # 4xx は送り直さない
+    assert len(session.posts) == 1
@@ -0,0 +1,48 @@
+import io
+import json
+
+import pytest
+
+import jsonstream
+
+ROWS = [
+    {"id": 1, "name": "アルトリア", "lv": 90, "rate": 1.5},
+    {"id": 22, "name": "a \"quoted\" \\ name", "tags": [1, [2, 3], {}]},
+    {"id": 333, "name": "", "none": None, "flag": True, "exp": -1.25e3},
+    12345,
+    "text",
+    [],
+]
+
+
+def documents():
+    yield "[]"
+    yield " [ ] "
+    yield json.dumps(ROWS)
+    yield json.dumps(ROWS, ensure_ascii=False)
+    yield json.dumps(ROWS, ensure_ascii=False, indent=2)
+    yield "\ufeff" + json.dumps(ROWS, ensure_ascii=False)
+    yield "[1,2,3,45678]"
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 8))
+def test_iter_stdlib_matches_json_loads(chunk_size):
+    for text in documents():
+        fp = io.BytesIO(text.encode("UTF-8"))
+        rows = list(jsonstream._iter_stdlib(fp, chunk_size))
+        assert rows == json.loads(text.lstrip("\ufeff")), text
+
+
+@pytest.mark.parametrize("text", ["{}", "[1, 2", "[1 2]", "", "[1,]"])
+def test_iter_stdlib_rejects_broken_json(text):
+    with pytest.raises(ValueError):
+        list(jsonstream._iter_stdlib(io.BytesIO(text.encode()), 3))
+
+
+def test_iter_rows():
+    rows = ROWS[:3]
+    fp = io.BytesIO(json.dumps(rows).encode())
+    assert list(jsonstream.iter_rows(fp, ["id", "name"],
+                                     lambda r: r["id"] > 1, chunk_size=5)) \
+        == [(22, rows[1]["name"]), (333, "")]
+    assert jsonstream.project_rows(rows, ["id"]) == [(1,), (22,), (333,)]
@@ -0,0 +1,86 @@
+import tablediff
+
+PREV = [
+    {"id": 1, "name": "a", "type": 1},
+    {"id": 2, "name": "b", "type": 2},
+    {"id": 3, "name": "c", "type": 1},
+    {"id": 3, "name": "c2", "type": 1},
+]
+
+
+def snapshot_diff(rows, prev_rows, key="id", row_filter=None):
+    prev_hashes = tablediff.group_fingerprints(
+        tablediff.group_rows(prev_rows, key))
+    loaded = []
+
+    def load_prev_rows():
+        loaded.append(True)
+        return prev_rows
+
+    diff, hashes = tablediff.diff_snapshot(rows, prev_hashes, load_prev_rows,
+                                           key=key, row_filter=row_filter)
+    assert hashes == tablediff.group_fingerprints(
+        tablediff.group_rows(rows, key))
+    return diff, len(loaded) > 0
+
+
+def test_added_only_does_not_load_prev():
+    rows = PREV + [{"id": 4, "name": "d", "type": 2}]
+    diff, loaded = snapshot_diff(rows, PREV)
+    assert diff == tablediff.diff_rows(rows, PREV)
+    assert list(diff.added) == [4]
+    assert not loaded
+
+
+def test_changed_and_grouped_rows():
+    rows = [dict(r) for r in PREV]
+    rows[1]["name"] = "B"
+    rows[3]["name"] = "C2"
+    diff, loaded = snapshot_diff(rows, PREV)
+    assert diff == tablediff.diff_rows(rows, PREV)
+    assert list(diff.changed) == [2, 3]
+    assert not loaded
+
+
+def test_removed_falls_back_to_diff_rows():
+    rows = [PREV[0], PREV[2], {"id": 5, "name": "e", "type": 1}]
+    diff, loaded = snapshot_diff(rows, PREV)
+    assert diff == tablediff.diff_rows(rows, PREV)
+    assert list(diff.removed) == [2]
+    assert loaded
+
+
+def test_row_filter():
+    def row_filter(row):
+        return row["type"] == 1
+
+    rows = [dict(r) for r in PREV] + [{"id": 4, "name": "d", "type": 1},
+                                      {"id": 6, "name": "f", "type": 2}]
+    diff, loaded = snapshot_diff(rows, PREV, row_filter=row_filter)
+    assert diff == tablediff.diff_rows(rows, PREV, row_filter=row_filter)
+    assert list(diff.added) == [4]
+    assert not loaded
+
+    # 行が変わってフィルターから外れた場合
+    rows[0]["type"] = 2
+    diff, loaded = snapshot_diff(rows, PREV, row_filter=row_filter)
+    assert diff == tablediff.diff_rows(rows, PREV, row_filter=row_filter)
+    assert list(diff.removed) == [1]
+    assert loaded
+
+
+def test_row_filter_with_removed_keys():
+    def row_filter(row):
+        return row["type"] == 1
+
+    rows = [PREV[0], {"id": 2, "name": "b", "type": 1}]
+    diff, loaded = snapshot_diff(rows, PREV, row_filter=row_filter)
+    assert diff == tablediff.diff_rows(rows, PREV, row_filter=row_filter)
+    assert list(diff.added) == [2]
+    assert list(diff.removed) == [3]
+    assert loaded
+
+
+def test_fingerprint_ignores_column_order():
+    assert tablediff.fingerprint({"id": 1, "name": "a"}) \
+        == tablediff.fingerprint({"name": "a", "id": 1})
@@ -3,39 +3,38 @@
 「現在確認している不具合について」の情報更新をチェックする
 """
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from pathlib import Path
 import difflib
-import configparser
-import sys
 import json
 
-from bs4 import BeautifulSoup
 import requests
-from discordwebhook import Discord
+
+import atomicfile
+import delivery
+import htmlextract
+import httpclient
+import runtime
 
 logger = logging.getLogger(__name__)
-inifile = "fgoupdate.ini"
-basedir = Path(__file__).resolve().parent
+basedir = runtime.basedir
 
 backup_f = basedir / "info_trouble.html"
 
 LOOP_TIMES = 15
 LOOP_SECONDS = 60
-
-# 設定ファイル読み込み
-config = configparser.ConfigParser()
-configfile = basedir / Path(inifile)
-if configfile.exists() is False:
-    print("ファイル {} を作成してください".format(inifile),
-          file=sys.stderr)
-    exit(1)
-config.read(configfile)
-section1 = 'discord'
-webhook_url = config.get(section1, 'webhook')
-discord = Discord(url=webhook_url)
-webhook_error_url = config.get(section1, 'webhook4error', fallback=webhook_url)
-discord_error = Discord(url=webhook_error_url)
+# 新しい記事を同時に取得する数
+FETCH_WORKERS = 4
+
+# 設定ファイル読み込み (fgoupdate と共有)
+discord = runtime.discord
+discord_error = runtime.discord_error
+state_dir = runtime.state_dir()
+# 一覧ページの ETag と本文のハッシュ
+validators_f = state_dir / "trouble_http.json"
+# 取得済みでまだ投稿できていない記事
+articles_f = state_dir / "trouble_articles.json"
 
 trouble_json = "trouble.json"
 
@@ -48,18 +47,70 @@ def troubleDiff(old, new) -> str:
 
 
 def html2dic(content):
-    soup = BeautifulSoup(content, "html.parser")
-    list_news = soup.select("ul.list_news li")
     news = []
-    for list_new in list_news:
-        title = list_new.select_one("p.title").get_text()
-        url_a = list_new.select_one("a")
-        url = url_a.attrs['href']
+    for title, url in htmlextract.news_list(content):
         if url != "/info/trouble/":
             news.append({"title": title, "url": url})
     return news
 
 
+def parse_article(content) -> dict:
+    """
+    記事のページからタイトルと本文を取り出す
+    """
+    title, main = htmlextract.article(content)
+    title = title.replace("  |  Fate/Grand Order 公式サイト", "")
+    description = main.replace(title, "").replace('\n\n\n\n', "")
+    return {"title": title, "description": description}
+
+
+def fetch_article(url):
+    """
+    記事を取得してパースする 取得できなければ None
+    """
+    r = httpclient.fetch("https://news.fate-go.jp" + url)
+    if r is None or r.status_code != requests.codes.ok:
+        logger.critical("ウェブサイトから情報取得できません")
+        return None
+    return parse_article(r.content)
+
+
+def load_articles() -> dict:
+    """
+    取得済みでまだ投稿できていない記事 URL -> parse_article の結果
+    """
+    try:
+        with open(articles_f, encoding="UTF-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("broken article cache %s: %s", articles_f, e)
+        return {}
+
+
+def save_articles(articles: dict):
+    atomicfile.write_json(articles_f, articles, ensure_ascii=False)
+
+
+def fetch_articles(urls) -> dict:
+    """
+    新しい記事を並行して取得する キャッシュにあれば取得しない
+    取得できた記事はすぐにキャッシュに保存する
+    """
+    cache = load_articles()
+    articles = {url: cache[url] for url in urls if url in cache}
+    todo = [url for url in urls if url not in cache]
+    if len(todo) > 0:
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+            for url, article in zip(todo, executor.map(fetch_article, todo)):
+                if article is not None:
+                    articles[url] = article
+        # 一覧から消えた記事はもう投稿しない
+        save_articles({url: articles[url] for url in urls if url in articles})
+    return articles
+
+
 def getTrouble():
     """
     ローカルのファイルとネット上のファイルでdiffをとる
@@ -73,48 +124,60 @@ def getTrouble():
     else:
         # ダウンロード
         logger.warning("FILE %s don't exists.", filename)
-        r = requests.get(target_url)
-        if r.status_code != requests.codes.ok:
+        r = httpclient.fetch(target_url)
+        if r is None or r.status_code != requests.codes.ok:
             logger.critical("ウェブサイトから情報取得できません")
-            exit()
+            return 0
         with open(filename, "w", encoding="UTF-8") as savefile:
             json.dump(html2dic(r.content), savefile, ensure_ascii=False)
         logger.critical("JSONファイルが無いので作成しました")
-        exit()
+        return 0
 
-    # 情報取得
-    r = requests.get(target_url)
-    if r.status_code != requests.codes.ok:
+    # 情報取得 前回から変わっていなければパースしない
+    validators = httpclient.Validators(validators_f)
+    r, changed = httpclient.fetch_if_changed(target_url, validators)
+    if r is None:
         logger.critical("ウェブサイトから情報取得できません")
-        exit()
+        return 0
+    if not changed:
+        return 0
     trouble = html2dic(r.content)
 
-    # 比較
-    urls = set(i["url"] for i in trouble) - set(i["url"] for i in trouble_prev)
+    # 比較 (一覧の順番で投稿する)
+    prev_urls = set(i["url"] for i in trouble_prev)
+    urls = [i["url"] for i in trouble if i["url"] not in prev_urls]
+    articles = fetch_articles(urls)
+    posted = {}
     for url in urls:
-        long_url = "https://news.fate-go.jp" + url
-        r2 = requests.get(long_url)
-        if r2.status_code != requests.codes.ok:
-            logger.critical("ウェブサイトから情報取得できません")
+        if url not in articles:
             continue
-        soup = BeautifulSoup(r2.content, "html.parser")
-        title = soup.find('title').get_text().replace("  |  Fate/Grand Order 公式サイト", "")
-        description = soup.find('main').get_text().replace(title, "").replace('\n\n\n\n', "")
+        article = articles[url]
         icon_url = "https://pbs.twimg.com/profile_images/1034364986041163776/tRqcymzd_400x400.jpg"
-        discord.post(username="FGO アップデート",
-                     embeds=[{
-                              "title": title,
-                              "author": {
-                                         "name": "Fate/Grand Order 公式サイト",
-                                         "icon_url": icon_url
-                                        },
-                              "url": long_url,
-                              "description": "```" + description + "```",
-                              "color": 5620992}])
+        posted[url] = discord.post(username="FGO アップデート",
+                                   embeds=[{
+                                            "title": article["title"],
+                                            "author": {
+                                                       "name": "Fate/Grand Order 公式サイト",
+                                                       "icon_url": icon_url
+                                                      },
+                                            "url": "https://news.fate-go.jp" + url,
+                                            "description": "```" + article["description"] + "```",
+                                            "color": 5620992}])
+    # 投稿できなかった記事は記録せず、次回キャッシュから投稿し直す
+    delivery.flush()
+    failed = set(url for url in urls
+                 if url not in posted
+                 or not all(m.delivered for m in posted[url]))
     if len(urls) > 0:
+        save_articles({url: articles[url] for url in urls
+                       if url in failed and url in articles})
         with open(filename, "w", encoding="UTF-8") as savefile:
-            json.dump(trouble, savefile, ensure_ascii=False)
-    return len(urls)
+            json.dump([i for i in trouble if i["url"] not in failed],
+                      savefile, ensure_ascii=False)
+    if len(failed) == 0:
+        validators.update(target_url, r)
+        validators.save()
+    return len(urls) - len(failed)
 
 
 if __name__ == '__main__':